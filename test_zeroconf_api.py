@@ -0,0 +1,144 @@
+"""Tests of the registry API over a Unix socket in a temporary directory"""
+from zeroconf_api import RegistryServer
+from zeroconf_core import ServiceRecord, ZeroconfListener
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+HTTP = "_http._tcp.local."
+IPP = "_ipp._tcp.local."
+WAIT = 5  # s a client waits for a line at most
+
+
+def record(name: str, type_: str, port: int = 80) -> ServiceRecord:
+    return ServiceRecord(f"{name}.{type_}", type_, f"{name}.local.", port, ("10.0.0.1",), (), (("path", "/"),))
+
+
+class Client:
+    """Blocking JSON lines client"""
+
+    def __init__(self, path: str) -> None:
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(WAIT)
+        self.socket.connect(path)
+        self.lines = self.socket.makefile('rb')
+
+    def send(self, request: dict) -> None:
+        self.socket.sendall((json.dumps(request) + '\n').encode())
+
+    def receive(self) -> dict:
+        line = self.lines.readline()
+        if not line:
+            raise ConnectionError("closed by the server")
+        return json.loads(line)
+
+    def close(self) -> None:
+        self.lines.close()
+        self.socket.close()
+
+
+class RegistryServerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "api.sock")
+        self.server = self.serve()
+        self.printer = record("printer", IPP, 631)
+        self.web = record("web", HTTP)
+        for service in (self.printer, self.web):
+            self.server.hook(ZeroconfListener.Event.ADD_SERVICE, service.name, service.type_, service)
+
+    def serve(self) -> RegistryServer:
+        server = RegistryServer(self.path)
+        self.assertTrue(server.start())
+        self.addCleanup(server.close)
+        return server
+
+    def client(self) -> Client:
+        client = Client(self.path)
+        self.addCleanup(client.close)
+        return client
+
+    def names(self, snapshot: dict) -> list[str]:
+        self.assertEqual(snapshot["op"], "snapshot")
+        return sorted(service["name"] for service in snapshot["services"])
+
+    def test_snapshot_is_filtered(self) -> None:
+        client = self.client()
+        client.send({"op": "snapshot"})
+        self.assertEqual(self.names(client.receive()), [self.printer.name, self.web.name])
+        client.send({"op": "snapshot", "type": HTTP})
+        self.assertEqual(self.names(client.receive()), [self.web.name])
+        client.send({"op": "snapshot", "name": "PRINT"})
+        snapshot = client.receive()
+        self.assertEqual(snapshot["services"], [json.loads(json.dumps(self.printer.as_dict()))])
+
+    def test_subscribe_round_trip(self) -> None:
+        client = self.client()
+        client.send({"op": "subscribe", "type": HTTP})
+        self.assertEqual(self.names(client.receive()), [self.web.name])
+        moved = record("web", HTTP, 8080)
+        other = record("scanner", IPP)
+        # Only changes of subscribed types reach the client, repeats not at all
+        self.server.hook(ZeroconfListener.Event.ADD_SERVICE, other.name, other.type_, other)
+        self.server.hook(ZeroconfListener.Event.UPDATE_SERVICE, self.web.name, HTTP, self.web)
+        self.server.hook(ZeroconfListener.Event.UPDATE_SERVICE, moved.name, HTTP, moved)
+        self.server.hook(ZeroconfListener.Event.REMOVE_SERVICE, moved.name, HTTP)
+        update = client.receive()
+        self.assertEqual((update["event"], update["name"], update["port"]), ("update", moved.name, 8080))
+        remove = client.receive()
+        self.assertEqual((remove["event"], remove["name"], remove["type"]), ("remove", moved.name, HTTP))
+        self.assertNotIn("port", remove)
+        added = record("api", HTTP)
+        self.server.hook(ZeroconfListener.Event.ADD_SERVICE, added.name, HTTP, added)
+        add = client.receive()
+        self.assertEqual((add["event"], add["name"], add["server"]), ("add", added.name, "api.local."))
+
+    def test_unsubscribe(self) -> None:
+        client = self.client()
+        client.send({"op": "subscribe", "snapshot": False})
+        client.send({"op": "unsubscribe"})
+        client.send({"op": "snapshot", "type": HTTP})
+        # Requests are answered in order, so the snapshot shows unsubscribe was handled
+        self.assertEqual(self.names(client.receive()), [self.web.name])
+        self.server.hook(ZeroconfListener.Event.REMOVE_SERVICE, self.web.name, HTTP)
+        client.send({"op": "snapshot", "type": HTTP})
+        self.assertEqual(self.names(client.receive()), [])
+
+    def test_bad_requests_are_answered_with_errors(self) -> None:
+        client = self.client()
+        for request in (b'not json\n', b'[1]\n', b'{"op": "snapshot", "type": 1}\n', b'{"op": "nope"}\n'):
+            with self.subTest(request=request):
+                client.socket.sendall(request)
+                self.assertIn("error", client.receive())
+        client.send({"op": "snapshot", "type": IPP})
+        self.assertEqual(self.names(client.receive()), [self.printer.name])
+
+    def test_socket_is_private_and_removed_on_close(self) -> None:
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.server.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_served_socket_is_not_taken_over(self) -> None:
+        other = RegistryServer(self.path)
+        self.assertFalse(other.start())
+        client = self.client()
+        client.send({"op": "snapshot"})
+        self.assertEqual(len(client.receive()["services"]), 2)
+
+    def test_stale_socket_file_is_replaced(self) -> None:
+        self.server.close()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.server = self.serve()
+        client = self.client()
+        client.send({"op": "snapshot"})
+        self.assertEqual(client.receive()["services"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
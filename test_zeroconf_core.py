@@ -0,0 +1,237 @@
+"""Tests of the Qt free discovery core"""
+from unittest import mock
+from zeroconf_core import (JOURNAL_MAGIC, EventJournal, SearchIndex, ServiceLifecycle, ServiceRecord, ServiceState, ZeroconfListener,
+                           replay_journal)
+import os
+import tempfile
+import unittest
+
+TYPE = "_test._tcp.local."
+
+
+def record(name: str, server: str, ipv4: tuple[str, ...] = (), properties: tuple[tuple[str, str], ...] = (),
+           type_: str = TYPE) -> ServiceRecord:
+    return ServiceRecord(f"{name}.{type_}", type_, server, 80, ipv4, (), properties)
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.index = SearchIndex()
+        self.printer = record("Office Printer", "laser-1.local.", ("10.0.1.5",), (("model", "LJ4000"),), "_ipp._tcp.local.")
+        self.nas = record("nas", "storage.local.", ("10.0.2.7",), (("path", "/share"),))
+        self.dev = record("dev box", "dev-10.local.", ("192.168.1.10",))
+        for service in (self.printer, self.nas, self.dev):
+            self.index.add(service)
+
+    def search(self, query: str) -> set[str] | None:
+        return self.index.search(query)
+
+    def test_empty_query_is_none(self) -> None:
+        self.assertIsNone(self.search(""))
+        self.assertIsNone(self.search("   "))
+
+    def test_unscoped_prefix_matches_any_field(self) -> None:
+        # Name token, host token, address, TXT and type
+        self.assertEqual(self.search("offi"), {self.printer.name})
+        self.assertEqual(self.search("stor"), {self.nas.name})
+        self.assertEqual(self.search("10.0."), {self.printer.name, self.nas.name})
+        self.assertEqual(self.search("model=lj"), {self.printer.name})
+        self.assertEqual(self.search("_ipp"), {self.printer.name})
+        self.assertEqual(self.search("nothing"), set())
+
+    def test_scoped_prefix_matches_its_field_only(self) -> None:
+        # 10 is a host token of dev box, and starts addresses of the others
+        self.assertEqual(self.search("10"), {self.printer.name, self.nas.name, self.dev.name})
+        self.assertEqual(self.search("ip:10"), {self.printer.name, self.nas.name})
+        self.assertEqual(self.search("host:10"), {self.dev.name})
+        self.assertEqual(self.search("server:dev"), {self.dev.name})
+        self.assertEqual(self.search("addr:192.168."), {self.dev.name})
+        self.assertEqual(self.search("txt:path=/"), {self.nas.name})
+        self.assertEqual(self.search("name:stor"), set())
+        self.assertEqual(self.search("type:_test"), {self.nas.name, self.dev.name})
+
+    def test_terms_must_all_match(self) -> None:
+        self.assertEqual(self.search("ip:10.0 type:_ipp"), {self.printer.name})
+        self.assertEqual(self.search("dev nas"), set())
+
+    def test_update_and_remove(self) -> None:
+        self.index.add(record("nas", "backup.local.", ("10.0.2.7",)))
+        self.assertEqual(self.search("stor"), set())
+        self.assertEqual(self.search("backup"), {self.nas.name})
+        self.index.remove(self.nas.name)
+        self.assertEqual(self.search("10.0."), {self.printer.name})
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(set(self.index.names()), {self.printer.name, self.dev.name})
+
+    def test_refines(self) -> None:
+        self.assertTrue(SearchIndex.refines("de", "d"))
+        self.assertTrue(SearchIndex.refines("dev ip:10", "dev"))
+        self.assertTrue(SearchIndex.refines("ip:10.0", "ip:10"))
+        self.assertFalse(SearchIndex.refines("d", "de"))
+        self.assertFalse(SearchIndex.refines("ip:10", "10"))
+        self.assertFalse(SearchIndex.refines("10", "dev 10"))
+        self.assertFalse(SearchIndex.refines("dev", ""))
+
+    def test_narrowing_equals_full_search(self) -> None:
+        index = SearchIndex()
+        for i in range(1000):
+            index.add(record(f"device {i}", f"dev{i // 4}.local.", (f"10.{i % 3}.{i // 256}.{i % 256}",),
+                             (("model", f"m{i % 7}"),), f"_t{i % 5}._tcp.local."))
+        queries = ["d", "de", "dev", "dev1", "dev1 1", "dev1 10.", "dev1 10.1", "dev1 10.1 txt:model=m",
+                   "dev1 10.1 txt:model=m3", "ip:1", "ip:10.2", "ip:10.2.3 type:_t", "ip:10.2.3 type:_t4"]
+        narrowed = 0
+        for previous, query in zip(queries, queries[1:]):
+            if not SearchIndex.refines(query, previous):
+                continue
+            narrowed += 1
+            with self.subTest(previous=previous, query=query):
+                self.assertEqual(index.search(query, index.search(previous)), index.search(query))
+        self.assertEqual(narrowed, len(queries) - 2)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now: float = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ServiceLifecycleTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch('zeroconf_core.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_counts(self, lifecycle: ServiceLifecycle, **expected: int) -> None:
+        counts = {state.name.lower(): count for state, count in lifecycle.counts().items() if count}
+        self.assertEqual(counts, expected)
+        self.assertEqual(len(lifecycle), sum(expected.values()))
+
+    def test_removed_and_stale_expire_after_their_ttl(self) -> None:
+        lifecycle = ServiceLifecycle(removed_ttl=60, stale_ttl=600)
+        lifecycle.set("gone", TYPE, ServiceState.REMOVED)
+        lifecycle.set("old", TYPE, ServiceState.STALE)
+        lifecycle.set("here", TYPE, ServiceState.LIVE)
+        self.clock.now += 61
+        # Expired entries are swept on the next change
+        self.assertIs(lifecycle.state("gone"), ServiceState.REMOVED)
+        lifecycle.set("new", TYPE, ServiceState.RESOLVING)
+        self.assertIsNone(lifecycle.state("gone"))
+        self.assertIs(lifecycle.state("old"), ServiceState.STALE)
+        self.assert_counts(lifecycle, live=1, stale=1, resolving=1)
+        self.clock.now += 540
+        lifecycle.set("new", TYPE, ServiceState.LIVE)
+        self.assertIsNone(lifecycle.state("old"))
+        self.assert_counts(lifecycle, live=2)
+
+    def test_sweep_runs_at_most_once_per_interval(self) -> None:
+        lifecycle = ServiceLifecycle(removed_ttl=0.1 * ServiceLifecycle.SWEEP_INTERVAL)
+        lifecycle.set("gone", TYPE, ServiceState.REMOVED)
+        self.clock.now += 0.5 * ServiceLifecycle.SWEEP_INTERVAL
+        # Expired, but the last sweep was too recent
+        lifecycle.set("other", TYPE, ServiceState.LIVE)
+        self.assertIs(lifecycle.state("gone"), ServiceState.REMOVED)
+        self.clock.now += 0.5 * ServiceLifecycle.SWEEP_INTERVAL
+        lifecycle.set("other", TYPE, ServiceState.LIVE)
+        self.assertIsNone(lifecycle.state("gone"))
+
+    def test_state_change_restarts_the_ttl(self) -> None:
+        lifecycle = ServiceLifecycle(removed_ttl=60, stale_ttl=600)
+        lifecycle.set("back", TYPE, ServiceState.REMOVED)
+        self.clock.now += 30
+        lifecycle.set("back", TYPE, ServiceState.LIVE)
+        self.clock.now += 60
+        lifecycle.set("other", TYPE, ServiceState.LIVE)
+        self.assertIs(lifecycle.state("back"), ServiceState.LIVE)
+
+    def test_least_recently_changed_are_evicted_past_capacity(self) -> None:
+        lifecycle = ServiceLifecycle(capacity=3)
+        for name in ("a", "b", "c"):
+            lifecycle.set(name, TYPE, ServiceState.LIVE)
+        # a changed last now, b is the oldest
+        lifecycle.set("a", TYPE, ServiceState.STALE)
+        lifecycle.set("d", TYPE, ServiceState.RESOLVING)
+        self.assertIsNone(lifecycle.state("b"))
+        self.assertEqual([lifecycle.state(name) for name in ("a", "c", "d")],
+                         [ServiceState.STALE, ServiceState.LIVE, ServiceState.RESOLVING])
+        self.assert_counts(lifecycle, live=1, stale=1, resolving=1)
+        # An evicted stale entry leaves nothing behind to expire
+        lifecycle.set("e", TYPE, ServiceState.LIVE)
+        lifecycle.set("f", TYPE, ServiceState.LIVE)
+        self.assertIsNone(lifecycle.state("a"))
+        self.assertEqual(lifecycle._expiring[ServiceState.STALE], {})
+
+    def test_resolving_keeps_live(self) -> None:
+        lifecycle = ServiceLifecycle()
+        lifecycle.resolving("svc", TYPE)
+        self.assertIs(lifecycle.state("svc"), ServiceState.RESOLVING)
+        lifecycle.set("svc", TYPE, ServiceState.LIVE)
+        lifecycle.resolving("svc", TYPE)
+        self.assertIs(lifecycle.state("svc"), ServiceState.LIVE)
+
+
+class EventJournalTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "events.zcj")
+        self.added = ServiceRecord(f"Drucker \u00fc.{TYPE}", TYPE, "printer.local.", 631, ("10.0.0.5",), ("fe80::5",),
+                                   (("rp", "ipp/print"), ("note", "2. Stock")), "eth0")
+        self.updated = ServiceRecord(self.added.name, TYPE, "printer.local.", 632, ("10.0.0.5",))
+        self.events = [(ZeroconfListener.Event.ADD_SERVICE, self.added.name, TYPE, self.added),
+                       (ZeroconfListener.Event.UPDATE_SERVICE, self.updated.name, TYPE, self.updated),
+                       (ZeroconfListener.Event.REMOVE_SERVICE, self.added.name, TYPE, None)]
+
+    def write(self, events: list[tuple]) -> None:
+        journal = EventJournal(self.path)
+        for event in events:
+            journal.record(*event)
+        journal.close()
+
+    def read(self) -> list[tuple]:
+        return [entry[1:] for entry in EventJournal.read(self.path)]
+
+    def test_round_trip(self) -> None:
+        self.write(self.events)
+        self.assertEqual(self.read(), self.events)
+        times = [entry[0] for entry in EventJournal.read(self.path)]
+        self.assertEqual(times, sorted(times))
+
+    def test_reopened_journal_appends(self) -> None:
+        self.write(self.events[:1])
+        self.write(self.events[1:])
+        self.assertEqual(self.read(), self.events)
+        with open(self.path, 'rb') as journal:
+            self.assertEqual(journal.read().count(JOURNAL_MAGIC), 1)
+
+    def test_truncated_tail_is_skipped(self) -> None:
+        self.write(self.events)
+        size = os.path.getsize(self.path)
+        self.write(self.events[:1])
+        # Cut into the payload of the last entry, then into its header
+        for cut in (os.path.getsize(self.path) - 3, size + 5):
+            with self.subTest(cut=cut):
+                os.truncate(self.path, cut)
+                self.assertEqual(self.read(), self.events)
+
+    def test_replay(self) -> None:
+        self.write(self.events)
+        os.truncate(self.path, os.path.getsize(self.path) - 1)
+        replayed: list[tuple] = []
+        self.assertEqual(replay_journal(self.path, lambda *event: replayed.append(event), speed=0), 2)
+        self.assertEqual(replayed, self.events[:2])
+
+    def test_other_file_is_rejected(self) -> None:
+        with open(self.path, 'wb') as other:
+            other.write(b'SQLite format 3\0')
+        with self.assertRaises(ValueError):
+            self.read()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+"""Tests of the query schedule and record browser with a fake Zeroconf and clock
+
+The sharded discovery runs for real against a responder on the loopback
+interface.
+"""
+from unittest import mock
+from zeroconf import DNSPointer, RecordUpdate, ServiceInfo, Zeroconf
+from zeroconf.const import _CLASS_IN, _TYPE_PTR
+from zeroconf_core import ZeroconfListener
+from zeroconf_discovery import (QUERY_MIN_INTERVAL, QUERY_REFRESH_PERCENTS, QueryScheduler, RecordBrowser, ShardedDiscovery,
+                                interface_addresses)
+import queue
+import socket
+import unittest
+
+TYPE = "_test._tcp.local."
+LOOPBACK = "127.0.0.1"
+SHARD_WAIT = 15  # s a shard test waits for an event at most, a worker is a fresh process
+SHARD_QUIET = 3  # s without events before no duplicate is taken to come
+
+
+class FakeLoop:
+    """Runs callbacks when the test advances the clock"""
+
+    def __init__(self, clock: "FakeClock") -> None:
+        self.clock = clock
+        self.timer: tuple[float, callable] | None = None
+
+    def call_soon_threadsafe(self, callback: callable, *args) -> None:
+        callback(*args)
+
+    def is_running(self) -> bool:
+        return True
+
+    def call_later(self, delay: float, callback: callable) -> mock.Mock:
+        self.timer = (self.clock.now + 1000 * delay, callback)
+        return mock.Mock(cancel=lambda: setattr(self, 'timer', None))
+
+    def run_until(self, end: float, limit: int = 10000) -> None:
+        while self.timer is not None and self.timer[0] <= end:
+            limit -= 1
+            if limit < 0:
+                raise AssertionError("timer keeps firing without the clock moving on")
+            when, callback = self.timer
+            self.timer = None
+            self.clock.now = max(self.clock.now, when)
+            callback()
+        self.clock.now = end
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now: float = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeZeroconf:
+    def __init__(self, clock: FakeClock) -> None:
+        self.loop = FakeLoop(clock)
+        self.done = False
+        self.records: list[DNSPointer] = []
+        self.cache = mock.Mock(get_all_by_details=lambda name, type_, class_: list(self.records))
+        self.sent: list[float] = []
+        self.listeners: set = set()
+
+    def async_add_listener(self, listener, question) -> None:
+        self.listeners.add(listener)
+
+    def async_remove_listener(self, listener) -> None:
+        # Raises KeyError for an unknown listener like zeroconf does
+        self.listeners.remove(listener)
+
+    def answer(self, record: DNSPointer) -> None:
+        """Cache record like an incoming response does"""
+        old = next((cached for cached in self.records if cached.alias == record.alias), None)
+        self.records = [cached for cached in self.records if cached.alias != record.alias] + [record]
+        for listener in self.listeners:
+            listener.async_update_records(self, self.loop.clock.now, [RecordUpdate(record, old)])
+            listener.async_update_records_complete()
+
+    def async_send(self, out) -> None:
+        self.sent.append(self.loop.clock.now)
+
+
+class QuerySchedulerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch('zeroconf_discovery.current_time_millis', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.zc = FakeZeroconf(self.clock)
+        self.scheduler = QueryScheduler(self.zc)
+
+    def pointer(self, alias: str, ttl: int, age: float) -> DNSPointer:
+        return DNSPointer(TYPE, _TYPE_PTR, _CLASS_IN, ttl, alias, self.clock.now - 1000 * age)
+
+    def refreshes(self, record: DNSPointer) -> list[float]:
+        """Queries sent from the first refresh of record until it expires"""
+        start = record.get_expiration_time(QUERY_REFRESH_PERCENTS[0])
+        return [sent for sent in self.zc.sent if start <= sent < record.get_expiration_time(100)]
+
+    def assert_spaced(self) -> None:
+        for first, second in zip(self.zc.sent, self.zc.sent[1:]):
+            self.assertGreaterEqual(second - first, 1000 * QUERY_MIN_INTERVAL)
+
+    def test_answer_past_refresh_does_not_flood(self) -> None:
+        # 85 s into 100 s and its owner left without a goodbye
+        self.zc.records.append(self.pointer(f"gone.{TYPE}", 100, 85))
+        self.scheduler.add(TYPE)
+        self.zc.loop.run_until(self.clock.now + 15_000)
+        self.assert_spaced()
+        # The startup turns plus the refreshes not yet passed at 90 and 95 %
+        self.assertLessEqual(len(self.zc.sent), 4 + len(QUERY_REFRESH_PERCENTS))
+
+    def test_fresh_answer_is_refreshed_once_per_percent(self) -> None:
+        record = self.pointer(f"here.{TYPE}", 100, 0)
+        self.zc.records.append(record)
+        self.scheduler.add(TYPE)
+        self.zc.loop.run_until(record.get_expiration_time(100))
+        refreshes = self.refreshes(record)
+        self.assertEqual(len(refreshes), len(QUERY_REFRESH_PERCENTS))
+        for sent, percent in zip(refreshes, QUERY_REFRESH_PERCENTS):
+            self.assertAlmostEqual(sent, record.get_expiration_time(percent), delta=1)
+        self.assert_spaced()
+
+    def test_answered_again_is_refreshed_again(self) -> None:
+        self.zc.records.append(self.pointer(f"here.{TYPE}", 100, 0))
+        self.scheduler.add(TYPE)
+        self.zc.loop.run_until(self.clock.now + 96_000)
+        # The answer to the last refresh resets the record
+        record = self.pointer(f"here.{TYPE}", 100, 0)
+        self.zc.answer(record)
+        self.zc.loop.run_until(record.get_expiration_time(100))
+        self.assertEqual(len(self.refreshes(record)), len(QUERY_REFRESH_PERCENTS))
+
+
+class RecordBrowserTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.zc = FakeZeroconf(FakeClock())
+        self.browser = RecordBrowser(self.zc)
+
+    def test_close_without_types(self) -> None:
+        self.browser.close()
+        self.assertEqual(self.zc.listeners, set())
+
+    def test_close_removes_listener(self) -> None:
+        self.browser.add(TYPE, mock.Mock())
+        self.assertIn(self.browser, self.zc.listeners)
+        self.browser.close()
+        self.assertEqual(self.zc.listeners, set())
+        # Closing twice is harmless too
+        self.browser.close()
+
+
+def loopback_interface() -> str | None:
+    return next((name for name, addresses in interface_addresses().items() if LOOPBACK in addresses), None)
+
+
+@unittest.skipIf(loopback_interface() is None, "no IPv4 loopback interface")
+class ShardedDiscoveryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.interface = loopback_interface()
+        self.responder = Zeroconf(interfaces=[LOOPBACK])
+        self.addCleanup(self.responder.close)
+        self.info = ServiceInfo(TYPE, f"shard.{TYPE}", addresses=[socket.inet_aton(LOOPBACK)], port=8080,
+                                properties={"path": "/"}, server="shard-host.local.")
+        self.events: queue.Queue[tuple] = queue.Queue()
+        self.discovery = ShardedDiscovery(lambda *event: self.events.put(event), [self.interface])
+        self.addCleanup(self.discovery.close)
+
+    def event(self, timeout: float = SHARD_WAIT) -> tuple:
+        return self.events.get(timeout=timeout)
+
+    def assert_quiet(self) -> None:
+        with self.assertRaises(queue.Empty):
+            self.events.get(timeout=SHARD_QUIET)
+
+    def test_events_are_deduplicated_and_carry_the_interface(self) -> None:
+        self.responder.register_service(self.info)
+        self.discovery.browse([TYPE])
+        event, name, type_, record = self.event()
+        self.assertIs(event, ZeroconfListener.Event.ADD_SERVICE)
+        self.assertEqual((name, type_), (f"shard.{TYPE}", TYPE))
+        self.assertEqual((record.server, record.port, record.ipv4), ("shard-host.local.", 8080, (LOOPBACK,)))
+        self.assertEqual(record.interface, self.interface)
+        # Announcements and the answers to new queries repeat the same records
+        self.discovery.refresh()
+        self.assert_quiet()
+        self.responder.unregister_service(self.info)
+        self.assertEqual(self.event(), (ZeroconfListener.Event.REMOVE_SERVICE, f"shard.{TYPE}", TYPE))
+        self.assert_quiet()
+
+    def test_close_stops_the_worker_and_reader(self) -> None:
+        self.discovery.browse([TYPE])
+        processes = [process for process, _ in self.discovery._workers.values()]
+        self.assertEqual(len(processes), 1)
+        self.discovery.close()
+        self.assertFalse(self.discovery._reader.is_alive())
+        for process in processes:
+            self.assertFalse(process.is_alive())
+            # Left on its own, not terminated
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.discovery.interfaces, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Tests of the TCP probes against servers on the loopback interface"""
+from unittest import mock
+from zeroconf_core import Metrics, ServiceRecord
+from zeroconf_probe import PROBE_HOST_BURST, ProbeEngine
+import asyncio
+import queue
+import socket
+import threading
+import time
+import unittest
+
+TYPE = "_test._tcp.local."
+LOOPBACK = "127.0.0.1"
+WAIT = 5  # s a test waits for a probe result at most
+
+
+class LocalServer:
+    """asyncio TCP server on the loopback interface, in a thread of its own"""
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._accept, LOOPBACK, 0), self._loop).result(timeout=WAIT)
+        self.port: int = self._server.sockets[0].getsockname()[1]
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.close()
+
+    def close(self) -> None:
+        if not self._thread.is_alive():
+            return
+
+        async def stop() -> None:
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(stop(), self._loop).result(timeout=WAIT)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=WAIT)
+        self._loop.close()
+
+
+def closed_port() -> int:
+    """A loopback port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind((LOOPBACK, 0))
+        return sock.getsockname()[1]
+
+
+def record(port: int, name: str = "probed", address: str = LOOPBACK) -> ServiceRecord:
+    # No server name, so only the address is connected to
+    return ServiceRecord(f"{name}.{TYPE}", TYPE, '', port, (address,))
+
+
+class ProbeEngineTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.results: queue.Queue[tuple[str, float | None]] = queue.Queue()
+        self.metrics = Metrics()
+
+    def engine(self, **kwargs) -> ProbeEngine:
+        engine = ProbeEngine(lambda name, rtt: self.results.put((name, rtt)), metrics=self.metrics, **kwargs)
+        self.addCleanup(engine.close)
+        return engine
+
+    def server(self) -> LocalServer:
+        server = LocalServer()
+        self.addCleanup(server.close)
+        return server
+
+    def result(self) -> tuple[str, float | None]:
+        return self.results.get(timeout=WAIT)
+
+    def counter(self, metric: str) -> int:
+        return self.metrics.snapshot()["counters"].get(metric, {"total": 0})["total"]
+
+    def fake_connect(self, engine: ProbeEngine, delay: float) -> list[tuple[float, int]]:
+        """Replace the connects of engine, returns (start, connects in flight) of each"""
+        started: list[tuple[float, int]] = []
+        in_flight = 0
+
+        async def connect(protocol_factory, host: str, port: int):
+            nonlocal in_flight
+            in_flight += 1
+            started.append((time.monotonic(), in_flight))
+            await asyncio.sleep(delay)
+            in_flight -= 1
+            return mock.Mock(), None
+
+        patcher = mock.patch.object(engine._loop, 'create_connection', connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return started
+
+    def test_open_port_reports_rtt(self) -> None:
+        server = self.server()
+        self.engine().probe(record(server.port))
+        name, rtt = self.result()
+        self.assertEqual(name, f"probed.{TYPE}")
+        self.assertIsNotNone(rtt)
+        self.assertGreater(rtt, 0)
+        self.assertLess(rtt, WAIT)
+        self.assertEqual(self.counter('probe.unreachable'), 0)
+
+    def test_closed_port_reports_unreachable(self) -> None:
+        self.engine().probe(record(closed_port()))
+        self.assertEqual(self.result(), (f"probed.{TYPE}", None))
+        self.assertEqual(self.counter('probe.unreachable'), 1)
+
+    def test_result_is_cached(self) -> None:
+        server = self.server()
+        engine = self.engine(ttl=60)
+        engine.probe(record(server.port, "first"))
+        first = self.result()[1]
+        # Would be unreachable if it connected again
+        server.close()
+        engine.probe(record(server.port, "second"))
+        self.assertEqual(self.result(), (f"second.{TYPE}", first))
+        self.assertEqual(self.counter('probe.cached'), 1)
+
+    def test_concurrency_is_limited(self) -> None:
+        engine = self.engine(concurrency=3, host_rate=1000)
+        started = self.fake_connect(engine, 0.05)
+        for port in range(1, 11):
+            engine.probe(record(port, f"service{port}"))
+        for _ in range(10):
+            self.assertIsNotNone(self.result()[1])
+        self.assertEqual(len(started), 10)
+        self.assertEqual(max(in_flight for _, in_flight in started), 3)
+
+    def test_connects_to_a_host_are_rate_limited(self) -> None:
+        rate = 50
+        engine = self.engine(host_rate=rate)
+        started = self.fake_connect(engine, 0)
+        count = PROBE_HOST_BURST + 5
+        for port in range(1, count + 1):
+            engine.probe(record(port, f"service{port}"))
+        for _ in range(count):
+            self.result()
+        times = sorted(start for start, _ in started)
+        # The burst goes at once, each connect after it waits for a token
+        self.assertLess(times[PROBE_HOST_BURST - 1] - times[0], 1 / rate)
+        self.assertGreaterEqual(times[-1] - times[0], 0.9 * (count - PROBE_HOST_BURST) / rate)
+
+    def test_other_hosts_are_not_held_up(self) -> None:
+        rate = 1
+        engine = self.engine(host_rate=rate)
+        started = self.fake_connect(engine, 0)
+        for port in range(1, PROBE_HOST_BURST + 1):
+            engine.probe(record(port, f"service{port}"))
+        # Over the burst of the first host, waits a second
+        engine.probe(record(PROBE_HOST_BURST + 1, "waiting"))
+        engine.probe(record(1, "other", "127.0.0.2"))
+        names = [self.result()[0] for _ in range(PROBE_HOST_BURST + 2)]
+        self.assertLess(names.index(f"other.{TYPE}"), names.index(f"waiting.{TYPE}"))
+        self.assertEqual(len(started), PROBE_HOST_BURST + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,234 @@
+"""Serve the live service registry to local clients over a Unix socket
+
+Requests and answers are JSON lines. Requests are
+
+  {"op": "snapshot", "type": "_http._tcp.local.", "name": "printer"}
+  {"op": "subscribe", "type": "_http._tcp.local.", "name": "printer", "snapshot": true}
+  {"op": "unsubscribe"}
+
+type matches exactly and name is a case insensitive part of the service
+name, both are optional. A snapshot is answered with
+{"op": "snapshot", "services": [...]}, a subscription with the snapshot
+unless "snapshot" is false and then add, update and remove lines in the
+format of zeroconf_cli.py. Does not use Qt.
+"""
+from typing import TYPE_CHECKING
+from zeroconf_core import Metrics, ServiceRecord, ZeroconfListener
+import asyncio
+import os
+import socket
+import threading
+import time
+import json
+
+if TYPE_CHECKING:
+    from zeroconf import ServiceInfo
+
+API_LINE_LIMIT = 65536  # bytes of one request line at most
+API_BUFFER_LIMIT = 4 * 1024 * 1024  # bytes not yet read by a client before it is dropped
+
+
+def _matches(record: ServiceRecord, type_: str | None, name: str | None) -> bool:
+    """name is casefolded already"""
+    return (type_ is None or record.type_ == type_) and (name is None or name in record.name.casefold())
+
+
+class _Client:
+    """One connection and the services it is subscribed to"""
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer: asyncio.StreamWriter = writer
+        self.task: asyncio.Task | None = asyncio.current_task()
+        self.type_: str | None = None
+        self.name: str | None = None
+        # A large snapshot may wait in the buffer on top of the limit
+        self.buffer_limit: int = API_BUFFER_LIMIT
+
+    def matches(self, record: ServiceRecord) -> bool:
+        return _matches(record, self.type_, self.name)
+
+    def send(self, line: bytes) -> bool:
+        """Queue line, False if the client fell too far behind and was closed"""
+        if self.writer.is_closing():
+            return False
+        if self.writer.transport.get_write_buffer_size() > self.buffer_limit:
+            # Not close, that would keep the buffer until the client reads it
+            self.writer.transport.abort()
+            return False
+        self.writer.write(line)
+        return True
+
+
+class RegistryServer:
+    """Keeps the services passed to hook() and serves them on a Unix socket
+
+    Runs its own asyncio loop in a thread, hook() only hands the event over
+    to it so neither the listener nor the Qt event loop wait for clients.
+    Every delta is encoded once for all subscribers, clients that do not
+    read are dropped once API_BUFFER_LIMIT bytes wait for them.
+    """
+
+    def __init__(self, path: str, metrics: Metrics | None = None) -> None:
+        self.path: str = path
+        self.metrics: Metrics = metrics or Metrics()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="zeroconf-api", daemon=True)
+        self._listening = threading.Event()
+        self._server: asyncio.Server | None = None
+        # Only touched from the API loop
+        self._records: dict[str, ServiceRecord] = {}
+        self._clients: set[_Client] = set()
+        self._subscribers: set[_Client] = set()
+
+    def start(self) -> bool:
+        """Listen on path, returns False if that failed"""
+        self._thread.start()
+        self._listening.wait()
+        return self._server is not None
+
+    def hook(self, event: ZeroconfListener.Event, name: str, type_: str, info: "ServiceInfo | ServiceRecord" = None) -> None:
+        """Discovery hook, safe to call from any thread"""
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._update, event, name, type_, info)
+
+    def clear(self) -> None:
+        """Forget all services, subscribers get a remove for each"""
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._clear)
+
+    def close(self) -> None:
+        if self._server is None or not self._thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._remove_stale()
+            self._server = self._loop.run_until_complete(asyncio.start_unix_server(self._serve, self.path, limit=API_LINE_LIMIT))
+            # Only this user may see the services
+            os.chmod(self.path, 0o600)
+        except (OSError, NotImplementedError) as ex:
+            print(f"API: Cannot listen on {self.path}: {ex}")
+            self._server = None
+            self._listening.set()
+            self._loop.close()
+            return
+        self._listening.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _remove_stale(self) -> None:
+        """Remove a socket file left behind by a crash, not one still served"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if not os.path.exists(self.path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+                return
+        raise OSError(f"{self.path} is served by another process")
+
+    async def _close(self) -> None:
+        self._server.close()
+        # Aborted connections end their _serve tasks, close would wait for clients to read
+        tasks = [client.task for client in self._clients if client.task is not None]
+        for client in self._clients:
+            client.writer.transport.abort()
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+
+    def _update(self, event: ZeroconfListener.Event, name: str, type_: str, info: "ServiceInfo | ServiceRecord") -> None:
+        if event is ZeroconfListener.Event.REMOVE_SERVICE:
+            record = self._records.pop(name, None)
+            if record is None:
+                return
+            self._publish('remove', record)
+            return
+        record = ServiceRecord.of(name, type_, info)
+        previous = self._records.get(name)
+        if previous == record:
+            return
+        self._records[name] = record
+        self._publish('add' if previous is None else 'update', record)
+
+    def _clear(self) -> None:
+        records, self._records = self._records, {}
+        for record in records.values():
+            self._publish('remove', record)
+
+    def _publish(self, event: str, record: ServiceRecord) -> None:
+        self.metrics.count('api.events')
+        line = None
+        for client in [client for client in self._subscribers if client.matches(record)]:
+            if line is None:
+                fields = {"time": time.time(), "event": event, "name": record.name, "type": record.type_}
+                if event != 'remove':
+                    fields.update(record.as_dict())
+                line = self._encode(fields)
+            if not client.send(line):
+                self.metrics.count('api.dropped')
+                self._subscribers.discard(client)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = _Client(writer)
+        self._clients.add(client)
+        self.metrics.gauge('api.clients', len(self._clients))
+        try:
+            while line := await reader.readline():
+                self._request(client, line)
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError is a request line over API_LINE_LIMIT
+            pass
+        finally:
+            self._clients.discard(client)
+            self._subscribers.discard(client)
+            self.metrics.gauge('api.clients', len(self._clients))
+            writer.close()
+
+    def _request(self, client: _Client, line: bytes) -> None:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("not a JSON object")
+            op = request.get('op')
+            type_ = request.get('type')
+            name = request.get('name')
+            if not isinstance(type_, str | None) or not isinstance(name, str | None):
+                raise ValueError("type and name must be strings")
+        except ValueError as ex:
+            client.send(self._encode({"error": f"bad request: {ex}"}))
+            return
+        name = None if name is None else name.casefold()
+        match op:
+            case 'snapshot':
+                client.send(self._snapshot(type_, name))
+            case 'subscribe':
+                client.type_ = type_
+                client.name = name
+                if request.get('snapshot', True):
+                    snapshot = self._snapshot(type_, name)
+                    client.buffer_limit = API_BUFFER_LIMIT + len(snapshot)
+                    client.send(snapshot)
+                self._subscribers.add(client)
+            case 'unsubscribe':
+                self._subscribers.discard(client)
+            case _:
+                client.send(self._encode({"error": f"unknown op: {op}"}))
+
+    def _snapshot(self, type_: str | None, name: str | None) -> bytes:
+        services = [record.as_dict() for record in self._records.values() if _matches(record, type_, name)]
+        return self._encode({"op": "snapshot", "services": services})
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return (json.dumps(message) + '\n').encode()
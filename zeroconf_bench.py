@@ -0,0 +1,227 @@
+"""Synthetic load benchmark of the discovery to display pipeline
+
+Runs ZeroConfGui under the offscreen Qt platform with private settings and
+either calls ZeroConfGui.hook directly with generated ServiceInfo objects
+(--mode hook) or registers the services with a local Zeroconf responder
+(--mode network). Add, update and remove phases are timed for each N. Only
+the network mode browses, the hook mode sends and receives nothing.
+"""
+import os
+import socket
+import sys
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+_tmp = tempfile.mkdtemp(prefix="zeroconf_bench_")
+os.environ["XDG_CONFIG_HOME"] = os.path.join(_tmp, "config")
+os.environ["XDG_CACHE_HOME"] = os.path.join(_tmp, "cache")
+
+from PyQt6.QtCore import QSettings
+from PyQt6.QtWidgets import QApplication
+from zeroconf import ServiceInfo
+from zeroconf.asyncio import AsyncZeroconf
+from zeroconf_core import ZeroconfListener
+from zeroconf_gui import ServiceRecord, ServiceTreeModel, ZeroConfGui
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+import json
+
+BENCH_TYPE = "_zcbench._tcp.local."
+
+
+def make_info(i: int, generation: int = 0) -> ServiceInfo:
+    host = i // 4
+    return ServiceInfo(BENCH_TYPE, f"bench-{i}.{BENCH_TYPE}", port=10000 + i % 50000, server=f"bench-host-{host}.local.",
+                       addresses=[socket.inet_aton(f"10.{host >> 16 & 255}.{host >> 8 & 255}.{host & 255}")],
+                       properties={"model": "bench", "id": str(i), "generation": str(generation)})
+
+
+class Probe:
+    """Wraps the ZeroConfGui hot paths to time them and stamp visible rows"""
+
+    def __init__(self, window: ZeroConfGui) -> None:
+        self.window = window
+        self.time_in: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        self.announced: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self._applied: list[str] = []
+        for method in ('add_service', 'update_service', 'remove_service', 'items_changed'):
+            self._wrap(method)
+
+    def _wrap(self, method: str) -> None:
+        original = getattr(self.window, method)
+        self.time_in[method] = 0.0
+        self.calls[method] = 0
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = original(*args, **kwargs)
+            end = time.perf_counter()
+            self.time_in[method] += end - start
+            self.calls[method] += 1
+            if method == 'items_changed':
+                # Rows applied in this batch are laid out from here on
+                for name in self._applied:
+                    if name in self.announced:
+                        self.latencies.append(end - self.announced.pop(name))
+                self._applied.clear()
+            elif args:
+                self._applied.append(args[0])
+            return result
+        setattr(self.window, method, timed)
+
+    def reset(self) -> None:
+        for method in self.time_in:
+            self.time_in[method] = 0.0
+            self.calls[method] = 0
+        self.announced.clear()
+        self.latencies.clear()
+        self._applied.clear()
+
+
+def all_shown(model: ServiceTreeModel, infos: list[ServiceInfo]) -> callable:
+    """Condition that is true once the model holds every info"""
+    expected = [ServiceRecord.from_info(info.name, BENCH_TYPE, info) for info in infos]
+    matched = 0
+
+    def done() -> bool:
+        nonlocal matched
+        while matched < len(expected) and model.record(expected[matched].name) == expected[matched]:
+            matched += 1
+        return matched == len(expected)
+    return done
+
+
+def wait_for(app: QApplication, done: callable, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not done():
+        if time.monotonic() > deadline:
+            return False
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+    return True
+
+
+def drive_hook(window: ZeroConfGui, probe: Probe, infos: list[ServiceInfo], event: ZeroconfListener.Event) -> None:
+    """Feed events from another thread like the zeroconf threads do"""
+    def feed():
+        for info in infos:
+            probe.announced[info.name] = time.perf_counter()
+            window.hook(event, info.name, BENCH_TYPE, info)
+    threading.Thread(target=feed, daemon=True).start()
+
+
+def drive_network(aiozc: AsyncZeroconf, probe: Probe, infos: list[ServiceInfo], action: str) -> None:
+    async def announce():
+        tasks = []
+        for info in infos:
+            probe.announced[info.name] = time.perf_counter()
+            if action == 'add':
+                tasks.append(await aiozc.async_register_service(info, cooperating_responders=True))
+            elif action == 'update':
+                tasks.append(await aiozc.async_update_service(info))
+            else:
+                tasks.append(await aiozc.async_unregister_service(info))
+        await asyncio.gather(*tasks)
+    asyncio.run_coroutine_threadsafe(announce(), aiozc.zeroconf.loop)
+
+
+def bytes_per_service(n: int) -> float:
+    """Python heap used by the model per collapsed service"""
+    records = [ServiceRecord.from_info(info.name, BENCH_TYPE, info) for info in (make_info(i) for i in range(n))]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    model = ServiceTreeModel()
+    for record in records:
+        model.upsert(record)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del model
+    return used / n
+
+
+def run(app: QApplication, mode: str, n: int, timeout: float) -> dict:
+    window = ZeroConfGui(listen=mode == 'network')
+    window.show()
+    if mode == 'network':
+        window.start_listening([BENCH_TYPE])
+    model = window.service_tree_model
+    probe = Probe(window)
+    aiozc = AsyncZeroconf() if mode == 'network' else None
+    result = {"time": time.time(), "mode": mode, "n": n, "phases": {}}
+
+    infos = [make_info(i) for i in range(n)]
+    updated = [make_info(i, 1) for i in range(n)]
+    phases = (
+        ('add', infos, ZeroconfListener.Event.ADD_SERVICE, all_shown(model, infos)),
+        ('update', updated, ZeroconfListener.Event.UPDATE_SERVICE, all_shown(model, updated)),
+        ('remove', updated, ZeroconfListener.Event.REMOVE_SERVICE, lambda: len(model.records()) == 0),
+    )
+    for phase, phase_infos, event, done in phases:
+        probe.reset()
+        start = time.perf_counter()
+        if aiozc is None:
+            drive_hook(window, probe, phase_infos, event)
+        else:
+            drive_network(aiozc, probe, phase_infos, phase)
+        completed = wait_for(app, done, timeout)
+        elapsed = time.perf_counter() - start
+        latencies = sorted(probe.latencies)
+        result["phases"][phase] = {
+            "completed": completed,
+            "seconds": round(elapsed, 4),
+            "events_per_second": round(n / elapsed, 1),
+            "latency_ms": {
+                "p50": round(1000 * statistics.median(latencies), 2) if latencies else None,
+                "p95": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+                "max": round(1000 * latencies[-1], 2) if latencies else None,
+            },
+            "time_in_s": {method: round(seconds, 4) for method, seconds in probe.time_in.items()},
+            "calls": dict(probe.calls),
+        }
+
+    if aiozc is not None:
+        aiozc.zeroconf.close()
+    window.close()
+    app.processEvents()
+    result["bytes_per_service"] = round(bytes_per_service(n), 1)
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ZeroConf GUI pipeline with synthetic services")
+    parser.add_argument('-n', dest='counts', type=int, action='append', help="number of services (repeatable), default 100, 1000 and 10000")
+    parser.add_argument('--mode', choices=('hook', 'network'), default='hook', help="feed ZeroConfGui.hook directly or announce over loopback")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for each phase")
+    parser.add_argument('-o', '--output', help="append results as JSON lines to this file")
+    args = parser.parse_args(argv)
+
+    QSettings.setPath(QSettings.Format.NativeFormat, QSettings.Scope.UserScope, os.environ["XDG_CONFIG_HOME"])
+    # The private settings must not serve the user's API socket either
+    settings = QSettings("ZeroConfGui", "ZeroConfGui")
+    settings.setValue('api_socket', '')
+    # Probes of the synthetic hosts would skew the timings and go out on the network
+    settings.setValue('probe', json.dumps(False))
+    app = QApplication(sys.argv[:1])
+    for n in args.counts or [100, 1000, 10000]:
+        result = run(app, args.mode, n, args.timeout)
+        for phase, stats in result["phases"].items():
+            print(f"{args.mode:7} n={n:<6} {phase:6} {stats['events_per_second']:>10} ev/s  "
+                  f"p50 {stats['latency_ms']['p50']} ms  p95 {stats['latency_ms']['p95']} ms  "
+                  f"items_changed {stats['time_in_s']['items_changed']} s{'' if stats['completed'] else '  TIMEOUT'}")
+        print(f"{args.mode:7} n={n:<6} {result['bytes_per_service']} bytes/service")
+        if args.output:
+            with open(args.output, 'a') as out:
+                out.write(json.dumps(result) + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
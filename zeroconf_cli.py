@@ -0,0 +1,118 @@
+"""Stream discovered services as JSON lines without starting the GUI"""
+from zeroconf import ServiceInfo
+from zeroconf_core import RESOLVE_CONCURRENCY, EventJournal, ServiceRecord, ZeroconfListener
+from zeroconf_api import RegistryServer
+from zeroconf_discovery import Discovery, ShardedDiscovery
+from zeroconf_probe import ProbeEngine
+import argparse
+import threading
+import time
+import sys
+import json
+
+
+class EventWriter:
+    """Write add/update/remove events as JSON lines, dropping updates that change nothing"""
+
+    def __init__(self, out, probes: ProbeEngine | None = None) -> None:
+        self._out = out
+        self._lock = threading.Lock()
+        self._records: dict[str, ServiceRecord] = {}
+        self._probes: ProbeEngine | None = probes
+
+    def hook(self, event: ZeroconfListener.Event, name: str, type_: str, info: ServiceInfo = None) -> None:
+        with self._lock:
+            match event:
+                case ZeroconfListener.Event.ADD_SERVICE | ZeroconfListener.Event.UPDATE_SERVICE:
+                    record = ServiceRecord.of(name, type_, info)
+                    previous = self._records.get(name)
+                    if previous == record:
+                        return
+                    self._records[name] = record
+                    self._write('add' if previous is None else 'update', record)
+                    if self._probes is not None:
+                        self._probes.probe(record)
+                case ZeroconfListener.Event.REMOVE_SERVICE:
+                    record = self._records.pop(name, None)
+                    if record is None:
+                        return
+                    self._write('remove', record)
+                case _:
+                    print("ERROR: bad event", file=sys.stderr)
+
+    def probed(self, name: str, rtt: float | None) -> None:
+        """ProbeEngine hook, writes a probe line for services still known"""
+        with self._lock:
+            if name in self._records:
+                self._write_line({"time": time.time(), "event": "probe", "name": name,
+                                  "rtt_ms": None if rtt is None else round(1000 * rtt, 3)})
+
+    def _write(self, event: str, record: ServiceRecord) -> None:
+        line = {"time": time.time(), "event": event, "name": record.name, "type": record.type_}
+        if event != 'remove':
+            line.update(record.as_dict())
+        self._write_line(line)
+
+    def _write_line(self, line: dict) -> None:
+        self._out.write(json.dumps(line) + '\n')
+        self._out.flush()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Stream ZeroConf service events as JSON lines")
+    parser.add_argument('-t', '--type', dest='types', action='append', required=True,
+                        help="service type to browse, e.g. _http._tcp.local. (repeatable)")
+    parser.add_argument('-d', '--duration', type=float, default=None, help="stop after this many seconds")
+    parser.add_argument('-o', '--output', default='-', help="file to append events to, default stdout")
+    parser.add_argument('-i', '--interface', dest='interfaces', action='append',
+                        help="browse in a worker process on this network interface (repeatable), default all in one process")
+    parser.add_argument('--passive', action='store_true', help="send no queries, only listen to announcements and answers to others")
+    parser.add_argument('--record', metavar='FILE', help="also append the events to this binary journal for replay")
+    parser.add_argument('--api', metavar='SOCKET', help="also serve the services to local clients on this Unix socket")
+    parser.add_argument('--probe', action='store_true', help="also connect to each service and write probe events with the connect time")
+    parser.add_argument('--concurrency', type=int, default=RESOLVE_CONCURRENCY, help="services resolved at the same time")
+    args = parser.parse_args(argv)
+
+    api = RegistryServer(args.api) if args.api else None
+    if api is not None and not api.start():
+        return 1
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'a')
+    # writer is bound by the time the first probe finishes
+    probes = ProbeEngine(lambda name, rtt: writer.probed(name, rtt)) if args.probe else None
+    writer = EventWriter(out, probes)
+    journal = EventJournal(args.record) if args.record else None
+
+    def hook(event: ZeroconfListener.Event, name: str, type_: str, info: ServiceInfo = None) -> None:
+        if journal is not None:
+            journal.record(event, name, type_, info)
+        if api is not None:
+            api.hook(event, name, type_, info)
+        writer.hook(event, name, type_, info)
+
+    if args.interfaces:
+        discovery = ShardedDiscovery(hook, args.interfaces, args.concurrency, passive=args.passive)
+    else:
+        discovery = Discovery(hook, args.concurrency, passive=args.passive)
+    try:
+        for ex in discovery.browse(args.types):
+            print(f"ERROR: BadTypeInNameException: {ex}", file=sys.stderr)
+            return 2
+        threading.Event().wait(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        discovery.close()
+        if probes is not None:
+            probes.close()
+        if journal is not None:
+            journal.close()
+        if api is not None:
+            api.close()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
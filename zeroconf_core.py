@@ -0,0 +1,696 @@
+"""Discovery core shared by the GUI and the command line, does not use Qt"""
+from collections import OrderedDict
+from collections.abc import KeysView
+from enum import Enum
+from typing import TYPE_CHECKING
+import bisect
+import builtins
+import functools
+import itertools
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import json
+
+if TYPE_CHECKING:
+    # Only for annotations, zeroconf is loaded with zeroconf_discovery
+    from zeroconf import ServiceInfo, Zeroconf
+    from zeroconf_discovery import ServiceResolver
+
+RESOLVE_CONCURRENCY = 32
+LIFECYCLE_CAPACITY = 50000  # service names tracked at most
+REMOVED_TTL = 60  # s a removed service is remembered
+STALE_TTL = 120  # s a stale service is kept without a live event, from a snapshot or a failed resolve
+JOURNAL_MAGIC = b'ZCJ1'
+
+
+class Histogram:
+    """Latency histogram with fixed logarithmic buckets"""
+    __slots__ = ('count', 'total', 'max', 'buckets')
+    # Upper bounds from 10 us doubling up to about 10 s, then overflow
+    BOUNDS = tuple(0.00001 * 2 ** i for i in range(21))
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.buckets: list[int] = [0] * (len(self.BOUNDS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile"""
+        wanted = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0, "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95), "max": self.max, "buckets": self.buckets}
+
+
+class Metrics:
+    """Counters, gauges and latency histograms keyed by metric and service type
+
+    Cheap enough to stay enabled, every update is a dict lookup under a lock.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str | None], Histogram] = {}
+        self._counters: dict[tuple[str, str | None], int] = {}
+        self._gauges: dict[str, tuple[float, float]] = {}
+        self._started: float = time.time()
+
+    def observe(self, metric: str, seconds: float, type_: str | None = None) -> None:
+        with self._lock:
+            histogram = self._histograms.get((metric, type_))
+            if histogram is None:
+                histogram = self._histograms[(metric, type_)] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, metric: str, type_: str | None = None, n: int = 1) -> None:
+        with self._lock:
+            self._counters[(metric, type_)] = self._counters.get((metric, type_), 0) + n
+
+    def gauge(self, metric: str, value: float) -> None:
+        """Record the current value of metric, the maximum is kept as well"""
+        with self._lock:
+            _, peak = self._gauges.get(metric, (0, value))
+            self._gauges[metric] = (value, max(peak, value))
+
+    def snapshot(self) -> dict:
+        """Histograms and counters in total and per service type"""
+        with self._lock:
+            histograms = {key: histogram for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        latency: dict[str, dict] = {}
+        totals: dict[str, Histogram] = {}
+        for (metric, type_), histogram in sorted(histograms.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            entry = latency.setdefault(metric, {"by_type": {}})
+            totals.setdefault(metric, Histogram()).merge(histogram)
+            if type_ is not None:
+                entry["by_type"][type_] = histogram.as_dict()
+        for metric, histogram in totals.items():
+            latency[metric].update(histogram.as_dict())
+        counts: dict[str, dict] = {}
+        for (metric, type_), value in sorted(counters.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            entry = counts.setdefault(metric, {"total": 0, "by_type": {}})
+            entry["total"] += value
+            if type_ is not None:
+                entry["by_type"][type_] = value
+        return {"since": self._started, "time": time.time(), "latency": latency, "counters": counts,
+                "gauges": {metric: {"last": last, "max": peak} for metric, (last, peak) in gauges.items()}}
+
+    def export(self, path: str) -> None:
+        with open(path, 'w') as out:
+            json.dump(self.snapshot(), out, indent=2)
+
+
+def timed(metric: str, type_arg: int | None = None):
+    """Observe the duration of a method in self.metrics
+
+    type_arg is the position of the service type among the call arguments.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                type_ = args[type_arg] if type_arg is not None and len(args) > type_arg else None
+                self.metrics.observe(metric, time.perf_counter() - start, type_)
+        return wrapper
+    return decorator
+
+
+class StartupProfile:
+    """Time spent per import and per startup phase, printed by report()
+
+    Does nothing unless enabled. An import is timed at the outermost import
+    statement that loads it, the modules it imports in turn count towards it.
+    """
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled: bool = enabled
+        self.imports: dict[str, float] = {}
+        self.phases: list[tuple[str, float]] = []
+        self._start: float = time.perf_counter()
+        self._last: float = self._start
+        self._depth: int = 0
+        self._import: callable = builtins.__import__
+        if enabled:
+            builtins.__import__ = self._timed_import
+
+    def mark(self, phase: str) -> None:
+        """End a phase that started at the previous mark"""
+        if self.enabled:
+            now = time.perf_counter()
+            self.phases.append((phase, now - self._last))
+            self._last = now
+
+    def report(self) -> None:
+        """Print the imports, slowest first, and the phases, then stop timing imports"""
+        if not self.enabled:
+            return
+        builtins.__import__ = self._import
+        self.enabled = False
+        for name, seconds in sorted(self.imports.items(), key=lambda item: -item[1]):
+            print(f"STARTUP: import {name:32} {1000 * seconds:8.1f} ms")
+        for phase, seconds in self.phases:
+            print(f"STARTUP: {phase:39} {1000 * seconds:8.1f} ms")
+        print(f"STARTUP: {'total':39} {1000 * (self._last - self._start):8.1f} ms")
+        sys.stdout.flush()
+
+    def _timed_import(self, name: str, globals=None, locals=None, fromlist=(), level: int = 0):
+        if self._depth or level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self.imports[name] = self.imports.get(name, 0.0) + time.perf_counter() - start
+
+
+class ServiceState(Enum):
+    RESOLVING = 0
+    LIVE = 1
+    STALE = 2
+    REMOVED = 3
+
+
+class ServiceLifecycle:
+    """Lifecycle state of every service name with bounded memory
+
+    Removed and stale entries are evicted after their TTL and the least
+    recently changed entries go first once more than capacity are tracked, so
+    names that come and go do not pile up. Safe to use from any thread.
+    """
+    # Seconds between sweeps for expired entries
+    SWEEP_INTERVAL = 1.0
+
+    def __init__(self, capacity: int = LIFECYCLE_CAPACITY, removed_ttl: float = REMOVED_TTL, stale_ttl: float = STALE_TTL) -> None:
+        self._lock = threading.Lock()
+        self._capacity: int = max(1, capacity)
+        self._ttl: dict[ServiceState, float] = {ServiceState.REMOVED: removed_ttl, ServiceState.STALE: stale_ttl}
+        # Name to (state, type_) in least recently changed order
+        self._entries: OrderedDict[str, tuple[ServiceState, str]] = OrderedDict()
+        # Names in removed or stale state to their expiry, oldest first
+        self._expiring: dict[ServiceState, OrderedDict[str, float]] = {state: OrderedDict() for state in self._ttl}
+        self._counts: dict[ServiceState, int] = {state: 0 for state in ServiceState}
+        self._next_sweep: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def state(self, name: str) -> ServiceState | None:
+        with self._lock:
+            entry = self._entries.get(name)
+        return None if entry is None else entry[0]
+
+    def counts(self) -> dict[ServiceState, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def set(self, name: str, type_: str, state: ServiceState) -> ServiceState | None:
+        """Move name to state, returns the previous state"""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._drop(name)
+            self._entries[name] = (state, type_)
+            self._counts[state] += 1
+            if state in self._expiring:
+                self._expiring[state][name] = now + self._ttl[state]
+            if now >= self._next_sweep:
+                self._sweep(now)
+            while len(self._entries) > self._capacity:
+                self._drop(next(iter(self._entries)))
+        return previous
+
+    def resolving(self, name: str, type_: str) -> None:
+        """Mark name as being resolved unless it is already live"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None or entry[0] is not ServiceState.LIVE:
+            self.set(name, type_, ServiceState.RESOLVING)
+
+    def _drop(self, name: str) -> ServiceState | None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return None
+        self._counts[entry[0]] -= 1
+        if entry[0] in self._expiring:
+            self._expiring[entry[0]].pop(name, None)
+        return entry[0]
+
+    def _sweep(self, now: float) -> None:
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        for expiring in self._expiring.values():
+            while expiring:
+                name, expires = next(iter(expiring.items()))
+                if expires > now:
+                    break
+                self._drop(name)
+
+
+class ZeroconfListener:
+    """Hands the services RecordBrowser reports to the resolver
+
+    Has the methods of zeroconf.ServiceListener without deriving from it so
+    this module does not import zeroconf.
+    """
+
+    class Event(Enum):
+        UPDATE_SERVICE = 0
+        REMOVE_SERVICE = 1
+        ADD_SERVICE = 2
+
+    def __init__(self, resolver: "ServiceResolver", metrics: Metrics) -> None:
+        self._resolver: "ServiceResolver" = resolver
+        self.metrics: Metrics = metrics
+
+    @timed('listener.update_service', type_arg=1)
+    def update_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        self._resolver.resolve(self.Event.UPDATE_SERVICE, type_, name)
+        # print(f"Service {name} updated: {type_}")
+
+    @timed('listener.remove_service', type_arg=1)
+    def remove_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        self._resolver.remove(type_, name)
+        # print(f"Service {name} removed {type_}")
+
+    @timed('listener.add_service', type_arg=1)
+    def add_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        self._resolver.resolve(self.Event.ADD_SERVICE, type_, name)
+        # print(f"Service {name} added")
+
+
+class TypeListener:
+    """Collect the service types announced on the network"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._types: set[str] = set()
+        self._hook: callable = None
+
+    def set_hook(self, hook: callable) -> None:
+        """hook(type_) is called once for each newly seen type"""
+        self._hook = hook
+
+    def types(self) -> list[str]:
+        with self._lock:
+            return list(self._types)
+
+    def add_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        with self._lock:
+            if name in self._types:
+                return
+            self._types.add(name)
+        if self._hook is not None:
+            self._hook(name)
+
+    def update_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        self.add_service(zc, type_, name)
+
+    def remove_service(self, zc: "Zeroconf", type_: str, name: str) -> None:
+        pass
+
+
+class EventQueue:
+    """Pending listener events, collapsed to the latest state per service
+
+    Filled from the zeroconf threads and drained in batches by the GUI.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._events: dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def put(self, event: ZeroconfListener.Event, name: str, type_: str, info: "ServiceInfo" = None) -> bool:
+        """Queue an event, returns True if the queue was empty"""
+        with self._lock:
+            was_empty = not self._events
+            previous = self._events.pop(name, None)
+            if previous is not None and previous[0] is ZeroconfListener.Event.ADD_SERVICE and event is ZeroconfListener.Event.UPDATE_SERVICE:
+                # Not added to the model yet
+                event = ZeroconfListener.Event.ADD_SERVICE
+            self._events[name] = (event, name, type_, info)
+            return was_empty
+
+    def take(self) -> list[tuple]:
+        """Remove and return all pending events in arrival order"""
+        with self._lock:
+            events = list(self._events.values())
+            self._events.clear()
+        return events
+
+
+class ServiceRecord:
+    """Compact resolved state of one service"""
+    __slots__ = ('name', 'type_', 'server', 'port', 'ipv4', 'ipv6', 'properties', 'interface')
+
+    def __init__(self, name: str, type_: str, server: str, port: int, ipv4: tuple[str, ...] = (), ipv6: tuple[str, ...] = (), properties: tuple[tuple[str, str], ...] = (), interface: str = '') -> None:
+        self.name: str = name
+        self.type_: str = type_
+        self.server: str = server
+        self.port: int = port
+        self.ipv4: tuple[str, ...] = ipv4
+        self.ipv6: tuple[str, ...] = ipv6
+        self.properties: tuple[tuple[str, str], ...] = properties
+        # Network interfaces the service was seen on, empty unless sharded
+        self.interface: str = interface
+
+    @classmethod
+    def of(cls, name: str, type_: str, info: "ServiceInfo | ServiceRecord") -> "ServiceRecord":
+        """Record for the info passed to a hook, workers and replays pass records"""
+        return info if isinstance(info, ServiceRecord) else cls.from_info(name, type_, info)
+
+    @classmethod
+    def from_info(cls, name: str, type_: str, info: "ServiceInfo") -> "ServiceRecord":
+        return cls(name, type_, info.server, info.port,
+                   tuple(str(addr4) for addr4 in info._ipv4_addresses),
+                   tuple(str(addr6) for addr6 in info._ipv6_addresses),
+                   tuple((key, value) for key, value in info.decoded_properties.items() if key != '' and value is not None))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ServiceRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    __hash__ = None
+
+    def as_dict(self) -> dict:
+        """JSON friendly fields, interface only when set"""
+        fields = {"name": self.name, "type": self.type_, "server": self.server, "port": self.port, "ipv4": self.ipv4,
+                  "ipv6": self.ipv6, "properties": dict(self.properties)}
+        if self.interface:
+            fields["interface"] = self.interface
+        return fields
+
+    @property
+    def address(self) -> str:
+        return f'{self.server}:{self.port}'
+
+    def has_details(self) -> bool:
+        return bool(self.ipv4 or self.ipv6 or self.properties)
+
+
+class ServiceSnapshot:
+    """Last known services stored in a SQLite file"""
+
+    def __init__(self, path: str) -> None:
+        self._path: str = path
+
+    def load(self) -> list[ServiceRecord]:
+        if not os.path.exists(self._path):
+            return []
+        try:
+            with sqlite3.connect(self._path) as db:
+                rows = db.execute('SELECT name, type, server, port, ipv4, ipv6, properties FROM services').fetchall()
+        except sqlite3.Error as ex:
+            print(f"SNAPSHOT: Load failed {self._path}: {ex}")
+            return []
+        return [ServiceRecord(name, type_, server, port, tuple(json.loads(ipv4)), tuple(json.loads(ipv6)),
+                              tuple(tuple(prop) for prop in json.loads(properties)))
+                for name, type_, server, port, ipv4, ipv6, properties in rows]
+
+    def save(self, records: list[ServiceRecord]) -> None:
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        try:
+            with sqlite3.connect(self._path) as db:
+                db.execute('CREATE TABLE IF NOT EXISTS services (name TEXT PRIMARY KEY, type TEXT, server TEXT, port INTEGER, ipv4 TEXT, ipv6 TEXT, properties TEXT)')
+                db.execute('DELETE FROM services')
+                db.executemany('INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               [(record.name, record.type_, record.server, record.port, json.dumps(record.ipv4),
+                                 json.dumps(record.ipv6), json.dumps(record.properties)) for record in records])
+        except sqlite3.Error as ex:
+            print(f"SNAPSHOT: Save failed {self._path}: {ex}")
+
+
+class EventJournal:
+    """Append-only binary journal of the events passed to a hook
+
+    The file starts with JOURNAL_MAGIC followed by entries of a header
+    (payload length, time, event) and a payload of length prefixed UTF-8
+    strings and counts. The file is unbuffered and each entry is one write,
+    so a killed process leaves every entry written before it on disk and at
+    most the last one cut short, which read() skips.
+    """
+    _HEADER = struct.Struct('<IdB')  # payload length, time.time(), ZeroconfListener.Event value
+    _COUNT = struct.Struct('<H')
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._lock = threading.Lock()
+        # Unbuffered, a buffer would lose its entries with the process
+        self._file = open(path, 'ab', buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(JOURNAL_MAGIC)
+
+    def record(self, event: "ZeroconfListener.Event", name: str, type_: str, info: "ServiceInfo | ServiceRecord" = None) -> None:
+        parts = [self._string(name), self._string(type_)]
+        if info is None:
+            parts.append(b'\0')
+        else:
+            record = ServiceRecord.of(name, type_, info)
+            parts += [b'\1', self._string(record.server), self._COUNT.pack(record.port or 0),
+                      self._strings(record.ipv4), self._strings(record.ipv6),
+                      self._strings([text for pair in record.properties for text in pair]), self._string(record.interface)]
+        payload = b''.join(parts)
+        entry = self._HEADER.pack(len(payload), time.time(), event.value) + payload
+        with self._lock:
+            self._file.write(entry)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    @classmethod
+    def _string(cls, text: str) -> bytes:
+        data = text.encode()
+        return cls._COUNT.pack(len(data)) + data
+
+    @classmethod
+    def _strings(cls, texts) -> bytes:
+        return cls._COUNT.pack(len(texts)) + b''.join(cls._string(text) for text in texts)
+
+    @classmethod
+    def read(cls, path: str):
+        """Yield (time, event, name, type_, record or None) one entry at a time"""
+        with open(path, 'rb') as journal:
+            if journal.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+                raise ValueError(f"{path} is not an event journal")
+            while len(header := journal.read(cls._HEADER.size)) == cls._HEADER.size:
+                length, timestamp, event = cls._HEADER.unpack(header)
+                payload = journal.read(length)
+                if len(payload) < length:
+                    break
+                reader = _PayloadReader(payload)
+                name = reader.string()
+                type_ = reader.string()
+                record = None
+                if reader.byte():
+                    server = reader.string()
+                    port = reader.count()
+                    ipv4 = tuple(reader.strings())
+                    ipv6 = tuple(reader.strings())
+                    texts = reader.strings()
+                    record = ServiceRecord(name, type_, server, port, ipv4, ipv6, tuple(zip(texts[::2], texts[1::2])), reader.string())
+                yield timestamp, ZeroconfListener.Event(event), name, type_, record
+
+
+class _PayloadReader:
+    __slots__ = ('_data', '_offset')
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self._offset = 0
+
+    def byte(self) -> int:
+        self._offset += 1
+        return self._data[self._offset - 1]
+
+    def count(self) -> int:
+        (value,) = EventJournal._COUNT.unpack_from(self._data, self._offset)
+        self._offset += EventJournal._COUNT.size
+        return value
+
+    def string(self) -> str:
+        length = self.count()
+        self._offset += length
+        return self._data[self._offset - length:self._offset].decode()
+
+    def strings(self) -> list[str]:
+        return [self.string() for _ in range(self.count())]
+
+
+def replay_journal(path: str, hook: callable, speed: float = 1.0, stop: threading.Event | None = None) -> int:
+    """Feed a journal to hook with its original timing divided by speed
+
+    A speed of 0 replays as fast as possible. Entries are read as they are
+    due so captures of any length replay in constant memory. Returns the
+    number of events replayed.
+    """
+    stop = stop or threading.Event()
+    replayed = 0
+    first: float | None = None
+    start = time.monotonic()
+    for timestamp, event, name, type_, record in EventJournal.read(path):
+        if speed > 0:
+            if first is None:
+                first = timestamp
+            delay = start + (timestamp - first) / speed - time.monotonic()
+            if delay > 0 and stop.wait(delay):
+                break
+        if stop.is_set():
+            break
+        hook(event, name, type_, record)
+        replayed += 1
+    return replayed
+
+
+class SearchIndex:
+    """Inverted index over service names, hosts, addresses, TXT records and types
+
+    Terms of each field are kept in a sorted list so a prefix lookup is a
+    bisect plus the matching range. Queries are whitespace separated terms,
+    all of which must match. A term is a prefix of any field or scoped to one
+    field like ip:10.0. or txt:model=
+
+    Short prefixes match thousands of terms, for those the candidate services
+    are scanned instead, each keeps its terms in one string for that.
+    """
+    FIELDS = ('name', 'host', 'ip', 'txt', 'type')
+    ALIASES = {'server': 'host', 'addr': 'ip'}
+    _SPLIT = re.compile(r'[\s._\-]+')
+
+    def __init__(self) -> None:
+        self._terms: dict[str, list[str]] = {field: [] for field in self.FIELDS}
+        self._postings: dict[str, dict[str, set[str]]] = {field: {} for field in self.FIELDS}
+        # Name to '\0field\1term' for each of its terms
+        self._service_terms: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._service_terms)
+
+    def add(self, record: ServiceRecord) -> None:
+        """Index record, replacing what was indexed for its name"""
+        self.remove(record.name)
+        terms: set[tuple[str, str]] = set()
+        for field, text in (('name', record.name), ('host', record.server), ('type', record.type_)):
+            text = text.lower()
+            terms.add((field, text))
+            terms.update((field, token) for token in self._SPLIT.split(text) if token)
+        terms.update(('ip', address.lower()) for address in record.ipv4 + record.ipv6)
+        terms.update(('txt', f'{key}={value}'.lower()) for key, value in record.properties)
+        for field, term in terms:
+            postings = self._postings[field]
+            names = postings.get(term)
+            if names is None:
+                names = postings[term] = set()
+                bisect.insort(self._terms[field], term)
+            names.add(record.name)
+        self._service_terms[record.name] = ''.join(f'\0{field}\1{term}' for field, term in terms)
+
+    def remove(self, name: str) -> None:
+        service_terms = self._service_terms.pop(name, None)
+        if service_terms is None:
+            return
+        for field, term in (entry.split('\1', 1) for entry in service_terms.split('\0')[1:]):
+            postings = self._postings[field]
+            names = postings[term]
+            names.discard(name)
+            if not names:
+                del postings[term]
+                terms = self._terms[field]
+                del terms[bisect.bisect_left(terms, term)]
+
+    def names(self) -> KeysView[str]:
+        """Names of all indexed services"""
+        return self._service_terms.keys()
+
+    def clear(self) -> None:
+        for field in self.FIELDS:
+            self._terms[field].clear()
+            self._postings[field].clear()
+        self._service_terms.clear()
+
+    def search(self, query: str, within: set[str] | None = None) -> set[str] | None:
+        """Names matching every term of query, None for an empty query
+
+        within limits the result to those names, e.g. the matches of a query
+        this one refines.
+        """
+        matches: set[str] | None = within
+        words = query.lower().split()
+        if not words:
+            return None
+        for word in words:
+            field, _, prefix = word.partition(':')
+            field = self.ALIASES.get(field, field)
+            if field in self.FIELDS:
+                matches = self._prefix((field,), prefix, f'\0{field}\1{prefix}', matches)
+            else:
+                # Not a field, e.g. an IPv6 address
+                matches = self._prefix(self.FIELDS, word, f'\1{word}', matches)
+            if not matches:
+                break
+        return matches
+
+    @staticmethod
+    def refines(query: str, previous: str) -> bool:
+        """True if every match of query is a match of previous too
+
+        That is when each term of previous only got longer in query with the
+        same field, and query may have more terms after them.
+        """
+        old = previous.lower().split()
+        new = query.lower().split()
+        if not old or len(new) < len(old):
+            return False
+        return all(n.startswith(o) and (':' in o) == (':' in n) for o, n in zip(old, new))
+
+    def _prefix(self, fields: tuple[str, ...], prefix: str, key: str, within: set[str] | None) -> set[str]:
+        ranges = []
+        count = 0
+        for field in fields:
+            terms = self._terms[field]
+            start = bisect.bisect_left(terms, prefix)
+            # Terms starting with prefix sort right before prefix + U+FFFF
+            end = bisect.bisect_right(terms, prefix + '\uffff', start)
+            ranges.append((field, start, end))
+            count += end - start
+        candidates = self._service_terms.keys() if within is None else within
+        # A term costs its postings about what a candidate costs its scan
+        if count > len(candidates):
+            service_terms = self._service_terms
+            return {name for name in candidates if key in service_terms[name]}
+        names = set().union(*(self._postings[field][term] for field, start, end in ranges
+                              for term in itertools.islice(self._terms[field], start, end)))
+        return names if within is None else names & within
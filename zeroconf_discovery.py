@@ -0,0 +1,664 @@
+"""Network side of the discovery core, imported once browsing starts
+
+Kept apart from zeroconf_core so the GUI can show its window before the
+zeroconf package is loaded. Does not use Qt either.
+"""
+from collections import deque
+from zeroconf import (BadTypeInNameException, DNSOutgoing, DNSQuestion, RecordUpdate, RecordUpdateListener, ServiceInfo, ServiceListener,
+                      Zeroconf, current_time_millis, service_type_name)
+from zeroconf.asyncio import AsyncServiceInfo, AsyncZeroconf
+from zeroconf.const import _CLASS_IN, _FLAGS_QR_QUERY, _TYPE_A, _TYPE_AAAA, _TYPE_PTR
+from zeroconf_core import (RESOLVE_CONCURRENCY, Metrics, ServiceLifecycle, ServiceRecord, ServiceState, TypeListener,
+                           ZeroconfListener)
+import asyncio
+import ifaddr
+import multiprocessing
+import queue
+import socket
+import sys
+import threading
+import time
+
+RESOLVE_TIMEOUT = 3000  # ms
+SERVICE_TYPES = "_services._dns-sd._udp.local."
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)  # Linux only
+QUERY_MIN_INTERVAL = 1  # s between the first queries of a type, doubled after each
+QUERY_MAX_INTERVAL = 3600  # s between queries of a type at most
+QUERY_STARTUP_TURNS = 3  # first queries of a type sent even when all its answers are fresh
+QUERY_REFRESH_PERCENTS = (80, 85, 90, 95)  # % of its TTL at which a known answer is asked for again, once each
+PACKETS_REPORT_INTERVAL = 5  # s between packet counts sent by interface workers
+
+
+class ServiceResolver:
+    """Resolve services concurrently on the AsyncZeroconf event loop
+
+    Requests are handed over to the zeroconf loop so the browser thread never
+    blocks. At most `concurrency` lookups run at the same time, requests for a
+    name that is already being resolved are collapsed into one more lookup
+    after it and results are passed to the hook as soon as each lookup
+    completes.
+    """
+
+    def __init__(self, aiozc: AsyncZeroconf, hook: callable, concurrency: int = RESOLVE_CONCURRENCY, timeout: int = RESOLVE_TIMEOUT,
+                 metrics: Metrics | None = None, lifecycle: ServiceLifecycle | None = None, passive: bool = False) -> None:
+        self._aiozc: AsyncZeroconf = aiozc
+        self.metrics: Metrics = metrics or Metrics()
+        self.lifecycle: ServiceLifecycle = lifecycle or ServiceLifecycle()
+        self._loop: asyncio.AbstractEventLoop = aiozc.zeroconf.loop
+        self._hook: callable = hook
+        self._timeout: int = timeout
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Only touched from the zeroconf loop
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._again: set[str] = set()
+        # Passive lookups only read the cache, names wait here for the rest of their records
+        self.passive: bool = passive
+        self._incomplete: set[str] = set()
+
+    def resolve(self, event: ZeroconfListener.Event, type_: str, name: str) -> None:
+        """Queue a lookup, safe to call from any thread"""
+        self._loop.call_soon_threadsafe(self._start, event, type_, name)
+
+    def remove(self, type_: str, name: str) -> None:
+        """Drop any lookup in flight for name and report it removed"""
+        self._loop.call_soon_threadsafe(self._remove, type_, name)
+
+    def close(self) -> None:
+        """Cancel all lookups in flight"""
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._cancel_all)
+
+    def _start(self, event: ZeroconfListener.Event, type_: str, name: str) -> None:
+        if self.passive:
+            self._load(event, type_, name)
+            return
+        if name in self._tasks:
+            # The records may have changed after the running lookup read them
+            self._again.add(name)
+            return
+        self._tasks[name] = self._loop.create_task(self._resolve(event, type_, name))
+        self.lifecycle.resolving(name, type_)
+        self.metrics.gauge('resolve.in_flight', len(self._tasks))
+
+    def _remove(self, type_: str, name: str) -> None:
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+        self._again.discard(name)
+        self._incomplete.discard(name)
+        self.lifecycle.set(name, type_, ServiceState.REMOVED)
+        self._hook(ZeroconfListener.Event.REMOVE_SERVICE, name, type_)
+
+    def _cancel_all(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._again.clear()
+        self._incomplete.clear()
+
+    def _load(self, event: ZeroconfListener.Event, type_: str, name: str) -> None:
+        info = AsyncServiceInfo(type_, name)
+        if not info.load_from_cache(self._aiozc.zeroconf):
+            if event is ZeroconfListener.Event.ADD_SERVICE and name not in self._incomplete:
+                self._incomplete.add(name)
+                self.lifecycle.resolving(name, type_)
+            return
+        if name in self._incomplete:
+            # The first complete lookup is what adds the service
+            self._incomplete.discard(name)
+            event = ZeroconfListener.Event.ADD_SERVICE
+        self.lifecycle.set(name, type_, ServiceState.LIVE)
+        self._hook(event, name, type_, info)
+
+    async def _resolve(self, event: ZeroconfListener.Event, type_: str, name: str) -> None:
+        resolved = False
+        try:
+            async with self._semaphore:
+                start = time.perf_counter()
+                info = AsyncServiceInfo(type_, name)
+                resolved = await info.async_request(self._aiozc.zeroconf, self._timeout)
+                self.metrics.observe('resolve', time.perf_counter() - start, type_)
+                if not resolved:
+                    self.metrics.count('resolve.timeout', type_)
+                    if self.lifecycle.state(name) is ServiceState.RESOLVING:
+                        self.lifecycle.set(name, type_, ServiceState.STALE)
+                    print(f"RESOLVE: Timeout {name}")
+                    return
+        finally:
+            if self._tasks.get(name) is asyncio.current_task():
+                del self._tasks[name]
+                self.metrics.gauge('resolve.in_flight', len(self._tasks))
+                if name in self._again:
+                    self._again.discard(name)
+                    # Until a lookup got through the service is still to be added
+                    self._start(ZeroconfListener.Event.UPDATE_SERVICE if resolved else event, type_, name)
+        self.lifecycle.set(name, type_, ServiceState.LIVE)
+        self._hook(event, name, type_, info)
+
+
+class RecordBrowser(RecordUpdateListener):
+    """Browse service types from the records zeroconf caches, sends nothing
+
+    Calls add_service, update_service and remove_service of the listener of
+    each type like ServiceBrowser does, but from the zeroconf loop instead of
+    a thread per browser, and types come and go without starting over.
+    """
+
+    def __init__(self, zc: Zeroconf) -> None:
+        super().__init__()
+        self.zc: Zeroconf = zc
+        # Only touched from the zeroconf loop
+        self._listeners: dict[str, ServiceListener] = {}
+        self._pending: dict[tuple[str, str], ZeroconfListener.Event] = {}
+        self._registered: bool = False
+
+    @property
+    def types(self) -> list[str]:
+        return list(self._listeners)
+
+    def add(self, type_: str, listener: ServiceListener) -> None:
+        """Browse type_, services already in the cache are added right away"""
+        self.zc.loop.call_soon_threadsafe(self._add, type_, listener)
+
+    def remove(self, type_: str) -> None:
+        self.zc.loop.call_soon_threadsafe(self._remove, type_)
+
+    def close(self) -> None:
+        if self.zc.loop.is_running():
+            self.zc.loop.call_soon_threadsafe(self._close)
+
+    def _add(self, type_: str, listener: ServiceListener) -> None:
+        self._listeners[type_] = listener
+        self.zc.async_add_listener(self, DNSQuestion(type_, _TYPE_PTR, _CLASS_IN))
+        self._registered = True
+
+    def _remove(self, type_: str) -> None:
+        self._listeners.pop(type_, None)
+
+    def _close(self) -> None:
+        self._listeners.clear()
+        # zeroconf raises for a listener it does not know, e.g. only bad types were browsed
+        if self._registered:
+            self._registered = False
+            self.zc.async_remove_listener(self)
+
+    def _enqueue(self, event: ZeroconfListener.Event, type_: str, name: str) -> None:
+        # One call per name and batch, added wins over removed over updated
+        key = (name, type_)
+        pending = self._pending.get(key)
+        if (event is ZeroconfListener.Event.ADD_SERVICE
+                or (event is ZeroconfListener.Event.REMOVE_SERVICE and pending is not ZeroconfListener.Event.ADD_SERVICE)
+                or pending is None):
+            self._pending[key] = event
+
+    def async_update_records(self, zc: Zeroconf, now: float, records: list[RecordUpdate]) -> None:
+        for update in records:
+            record = update.new
+            if record.type == _TYPE_PTR:
+                if record.name in self._listeners:
+                    if update.old is None:
+                        self._enqueue(ZeroconfListener.Event.ADD_SERVICE, record.name, record.alias)
+                    elif record.is_expired(now):
+                        self._enqueue(ZeroconfListener.Event.REMOVE_SERVICE, record.name, record.alias)
+                continue
+            if update.old is not None or record.is_expired(now):
+                continue
+            if record.type in (_TYPE_A, _TYPE_AAAA):
+                names = {service.name for service in zc.cache.async_entries_with_server(record.name)}
+            else:
+                names = (record.name,)
+            for name in names:
+                for type_ in self._listeners:
+                    if name.endswith('.' + type_):
+                        self._enqueue(ZeroconfListener.Event.UPDATE_SERVICE, type_, name)
+
+    def async_update_records_complete(self) -> None:
+        pending, self._pending = self._pending, {}
+        for (name, type_), event in pending.items():
+            listener = self._listeners.get(type_)
+            if listener is None:
+                continue
+            match event:
+                case ZeroconfListener.Event.ADD_SERVICE:
+                    listener.add_service(self.zc, type_, name)
+                case ZeroconfListener.Event.REMOVE_SERVICE:
+                    listener.remove_service(self.zc, type_, name)
+                case ZeroconfListener.Event.UPDATE_SERVICE:
+                    listener.update_service(self.zc, type_, name)
+
+
+class QueryScheduler(RecordUpdateListener):
+    """One query schedule shared by all browsed types
+
+    The types that are due are asked together in one packet that carries
+    their known answers. The interval of a type starts at min_interval and
+    doubles after each turn up to max_interval. After the first
+    QUERY_STARTUP_TURNS turns, which catch services that missed a response,
+    a type whose cached answers are all still fresh is skipped on its turn.
+    New services announce themselves anyway, the type is asked again
+    at QUERY_REFRESH_PERCENTS of the TTL of each answer, once each so an
+    answer whose owner left without a goodbye costs a few queries. An
+    answer that arrives is planned for its first refresh right away. No type
+    is asked again sooner than min_interval.
+    """
+
+    def __init__(self, zc: Zeroconf, min_interval: float = QUERY_MIN_INTERVAL, max_interval: float = QUERY_MAX_INTERVAL,
+                 metrics: Metrics | None = None) -> None:
+        super().__init__()
+        self.zc: Zeroconf = zc
+        self.metrics: Metrics = metrics or Metrics()
+        self._min_interval: float = min_interval
+        self._max_interval: float = max_interval
+        # Only touched from the zeroconf loop, type -> (due ms, interval s)
+        self._schedule: dict[str, tuple[float, float]] = {}
+        # type -> alias -> (created ms, refresh queries sent) of its answers
+        self._refreshes: dict[str, dict[str, tuple[float, int]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._replan: bool = False
+
+    def add(self, type_: str) -> None:
+        self.zc.loop.call_soon_threadsafe(self._add, type_)
+
+    def remove(self, type_: str) -> None:
+        self.zc.loop.call_soon_threadsafe(self._remove, type_)
+
+    def reset(self) -> None:
+        """Ask every type now, fresh or not, and back off from the start again"""
+        self.zc.loop.call_soon_threadsafe(self._reset)
+
+    def close(self) -> None:
+        if self.zc.loop.is_running():
+            self.zc.loop.call_soon_threadsafe(self._close)
+
+    def _add(self, type_: str) -> None:
+        if not self._schedule:
+            self.zc.async_add_listener(self, None)
+        if type_ not in self._schedule:
+            # Spread the first query like RFC 6762 5.2 asks, 20-120 ms
+            self._schedule[type_] = (current_time_millis() + 20 + 100 * (hash(type_) % 1000) / 1000, self._min_interval)
+            self._plan()
+
+    def _remove(self, type_: str) -> None:
+        self._schedule.pop(type_, None)
+        self._refreshes.pop(type_, None)
+
+    def _reset(self) -> None:
+        now = current_time_millis()
+        for type_ in self._schedule:
+            self._schedule[type_] = (now, 0)
+        self._run()
+
+    def _close(self) -> None:
+        if self._schedule:
+            self.zc.async_remove_listener(self)
+        self._schedule.clear()
+        self._refreshes.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _plan(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._schedule:
+            due = min(when for when, _ in self._schedule.values())
+            self._timer = self.zc.loop.call_later(max(0.0, (due - current_time_millis()) / 1000), self._run)
+
+    def _run(self) -> None:
+        self._timer = None
+        if self.zc.done:
+            return
+        now = current_time_millis()
+        out = DNSOutgoing(_FLAGS_QR_QUERY)
+        for type_, (when, interval) in list(self._schedule.items()):
+            if when > now:
+                continue
+            answers = [record for record in self.zc.cache.get_all_by_details(type_, _TYPE_PTR, _CLASS_IN)
+                       if not record.is_expired(now)]
+            # A reset starts from 0 so it always asks
+            startup = interval < self._min_interval * 2 ** QUERY_STARTUP_TURNS
+            interval = min(self._max_interval, max(self._min_interval, interval * 2))
+            refresh = self._refresh(type_, answers, now)
+            # Come back before the next answer needs refreshing, but not right away
+            when = max(now + 1000 * self._min_interval, min(now + 1000 * interval, refresh))
+            self._schedule[type_] = (when, interval)
+            if answers and not startup and not any(record.is_stale(now) for record in answers):
+                self.metrics.count('query.skipped', type_)
+                continue
+            out.add_question(DNSQuestion(type_, _TYPE_PTR, _CLASS_IN))
+            for record in answers:
+                if not record.is_stale(now):
+                    out.add_answer_at_time(record, now)
+        if out.questions:
+            self.metrics.count('query.sent')
+            self.zc.async_send(out)
+        self._plan()
+
+    def async_update_records(self, zc: Zeroconf, now: float, records: list[RecordUpdate]) -> None:
+        for update in records:
+            record = update.new
+            # A goodbye is set to expire in a second, its refresh would only ask for nothing
+            if record.type != _TYPE_PTR or record.ttl <= 1 or record.name not in self._schedule:
+                continue
+            when, interval = self._schedule[record.name]
+            refresh = max(now + 1000 * self._min_interval, record.get_expiration_time(QUERY_REFRESH_PERCENTS[0]))
+            if refresh < when:
+                self._schedule[record.name] = (refresh, interval)
+                self._replan = True
+
+    def async_update_records_complete(self) -> None:
+        if self._replan:
+            self._replan = False
+            self._plan()
+
+    def _refresh(self, type_: str, answers: list, now: float) -> float:
+        """Count this turn as a refresh of the answers that are due, returns when the next one is"""
+        previous = self._refreshes.get(type_, {})
+        refreshes = self._refreshes[type_] = {}
+        due = float('inf')
+        for record in answers:
+            created, sent = previous.get(record.alias, (record.created, 0))
+            if created != record.created:
+                # Answered again since
+                sent = 0
+            while sent < len(QUERY_REFRESH_PERCENTS) and record.get_expiration_time(QUERY_REFRESH_PERCENTS[sent]) <= now:
+                sent += 1
+            refreshes[record.alias] = (record.created, sent)
+            if sent < len(QUERY_REFRESH_PERCENTS):
+                due = min(due, record.get_expiration_time(QUERY_REFRESH_PERCENTS[sent]))
+        return due
+
+
+class Discovery:
+    """One long lived Zeroconf instance browsing any number of service types
+
+    Resolved services and removals are passed to hook(event, name, type_, info)
+    from the zeroconf loop. Passive discovery sends no queries at all, it
+    only uses what others announce or ask for.
+    """
+
+    def __init__(self, hook: callable, concurrency: int = RESOLVE_CONCURRENCY, metrics: Metrics | None = None,
+                 lifecycle: ServiceLifecycle | None = None, interfaces: list[str] | None = None, passive: bool = False) -> None:
+        self.metrics: Metrics = metrics or Metrics()
+        self.lifecycle: ServiceLifecycle = lifecycle or ServiceLifecycle()
+        self.passive: bool = passive
+        if interfaces is None:
+            self._aiozc = AsyncZeroconf()
+        else:
+            self._aiozc = AsyncZeroconf(interfaces=interfaces)
+            _only_joined_multicast(self._aiozc.zeroconf)
+        self.zeroconf: Zeroconf = self._aiozc.zeroconf
+        # [whole second, packets sent in it] of the last minute at most
+        self._sent: deque[list[int]] = deque()
+        self._count_sent()
+        self._resolver = ServiceResolver(self._aiozc, hook, concurrency, metrics=self.metrics, lifecycle=self.lifecycle,
+                                         passive=passive)
+        self._listener = ZeroconfListener(self._resolver, self.metrics)
+        self._browser = RecordBrowser(self.zeroconf)
+        self._scheduler: QueryScheduler | None = None if passive else QueryScheduler(self.zeroconf, metrics=self.metrics)
+        self._types: set[str] = set()
+        self._type_listener = TypeListener()
+        self._discovering_types: bool = False
+
+    @property
+    def types(self) -> list[str]:
+        return list(self._types)
+
+    def browse(self, types: list[str]) -> list[BadTypeInNameException]:
+        """Browse exactly the given types, returns the errors of bad types"""
+        errors: list[BadTypeInNameException] = []
+        for type_ in self._types - set(types):
+            self._types.discard(type_)
+            self._browser.remove(type_)
+            if self._scheduler is not None:
+                self._scheduler.remove(type_)
+        for type_ in types:
+            if type_ in self._types:
+                continue
+            try:
+                service_type_name(type_, strict=False)
+            except BadTypeInNameException as ex:
+                errors.append(ex)
+                continue
+            self._types.add(type_)
+            self._browser.add(type_, self._listener)
+            if self._scheduler is not None:
+                self._scheduler.add(type_)
+        return errors
+
+    def discover_types(self, hook: callable = None) -> None:
+        """Keep browsing for service types, hook(type_) is called for each new one"""
+        self._type_listener.set_hook(hook)
+        if not self._discovering_types:
+            self._discovering_types = True
+            self._browser.add(SERVICE_TYPES, self._type_listener)
+            if self._scheduler is not None:
+                self._scheduler.add(SERVICE_TYPES)
+
+    def found_types(self) -> list[str]:
+        return self._type_listener.types()
+
+    def refresh(self) -> None:
+        """Query all browsed types again, the cache is kept, passive discovery stays quiet"""
+        if self._scheduler is not None:
+            self._scheduler.reset()
+
+    def packets_per_minute(self) -> int:
+        """mDNS packets this instance sent in the last minute"""
+        self._trim_sent(int(time.monotonic()))
+        return sum(count for _, count in self._sent)
+
+    def _trim_sent(self, second: int) -> None:
+        while self._sent and self._sent[0][0] <= second - 60:
+            self._sent.popleft()
+
+    def close(self) -> None:
+        if self._scheduler is not None:
+            self._scheduler.close()
+        self._browser.close()
+        self._resolver.close()
+        self.zeroconf.close()
+
+    def _count_sent(self) -> None:
+        # Zeroconf has no hook for outgoing packets, resolver queries go
+        # through async_send as well
+        send = self.zeroconf.async_send
+
+        def async_send(out: DNSOutgoing, *args, **kwargs) -> None:
+            second = int(time.monotonic())
+            if self._sent and self._sent[-1][0] == second:
+                self._sent[-1][1] += len(out.packets())
+            else:
+                # Trimmed here too, nothing may ask for the count, e.g. headless
+                self._trim_sent(second)
+                self._sent.append([second, len(out.packets())])
+            send(out, *args, **kwargs)
+        self.zeroconf.async_send = async_send
+
+
+def _only_joined_multicast(zc: Zeroconf) -> None:
+    """Receive multicast only on the interfaces zc joined
+
+    Linux hands the groups joined by any socket on port 5353 to all of them,
+    so without this every worker would see the traffic of every interface.
+    """
+    listen_socket = zc.engine._listen_socket
+    if listen_socket is not None and sys.platform.startswith('linux'):
+        listen_socket.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+
+
+def interface_addresses() -> dict[str, list[str]]:
+    """IPv4 addresses of each network interface by name"""
+    return {adapter.nice_name: [ip.ip for ip in adapter.ips if ip.is_IPv4] for adapter in ifaddr.get_adapters()}
+
+
+_TYPE_FOUND = -1  # worker message kinds next to the ZeroconfListener.Event values
+_PACKETS_SENT = -2
+
+
+def _interface_worker(interface: str, addresses: list[str], concurrency: int, passive: bool, events, commands) -> None:
+    """Worker process main, browses on one interface until a None command
+
+    Messages are (interface, kind, name, type_, fields) tuples, fields being
+    the ServiceRecord values after type_. Updates that change nothing are
+    not sent. Every few seconds the packets sent in the last minute are
+    reported as the name of a _PACKETS_SENT message.
+    """
+    records: dict[str, ServiceRecord] = {}
+    lock = threading.Lock()
+
+    def hook(event: ZeroconfListener.Event, name: str, type_: str, info: ServiceInfo = None) -> None:
+        with lock:
+            if event is ZeroconfListener.Event.REMOVE_SERVICE:
+                if records.pop(name, None) is not None:
+                    events.put((interface, event.value, name, type_, None))
+                return
+            record = ServiceRecord.from_info(name, type_, info)
+            if records.get(name) == record:
+                return
+            records[name] = record
+            events.put((interface, event.value, name, type_,
+                        (record.server, record.port, record.ipv4, record.ipv6, record.properties)))
+
+    discovery = Discovery(hook, concurrency, interfaces=addresses, passive=passive)
+    try:
+        while True:
+            try:
+                command = commands.get(timeout=PACKETS_REPORT_INTERVAL)
+            except queue.Empty:
+                events.put((interface, _PACKETS_SENT, discovery.packets_per_minute(), None, None))
+                continue
+            if command is None:
+                break
+            action, types = command
+            match action:
+                case 'browse':
+                    discovery.browse(types)
+                case 'discover_types':
+                    discovery.discover_types(lambda type_: events.put((interface, _TYPE_FOUND, type_, None, None)))
+                case 'refresh':
+                    discovery.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        discovery.close()
+
+
+class ShardedDiscovery:
+    """Discovery split over one worker process per network interface
+
+    Each worker runs its own Zeroconf on the IPv4 addresses of its interface
+    and sends deduplicated events back over a multiprocessing queue. A
+    service seen on several interfaces is one record whose interface lists
+    all of them, it is removed when the last interface loses it. hook gets
+    ServiceRecord objects where Discovery passes ServiceInfo.
+    """
+
+    def __init__(self, hook: callable, interfaces: list[str], concurrency: int = RESOLVE_CONCURRENCY,
+                 metrics: Metrics | None = None, lifecycle: ServiceLifecycle | None = None, passive: bool = False) -> None:
+        self.metrics: Metrics = metrics or Metrics()
+        self.lifecycle: ServiceLifecycle = lifecycle or ServiceLifecycle()
+        self.passive: bool = passive
+        self._hook: callable = hook
+        self._packets: dict[str, int] = {}
+        self._types: list[str] = []
+        self._seen: dict[str, dict[str, ServiceRecord]] = {}
+        self._type_listener = TypeListener()
+        # Workers must not inherit the Qt and zeroconf threads of this process
+        context = multiprocessing.get_context('spawn')
+        self._events = context.Queue()
+        self._workers: dict[str, tuple] = {}
+        addresses = interface_addresses()
+        for interface in interfaces:
+            if not addresses.get(interface):
+                print(f"DISCOVERY: No IPv4 address on interface {interface}")
+                continue
+            commands = context.Queue()
+            process = context.Process(target=_interface_worker, name=f"zeroconf-{interface}", daemon=True,
+                                      args=(interface, addresses[interface], concurrency, passive, self._events, commands))
+            process.start()
+            self._workers[interface] = (process, commands)
+        self._reader = threading.Thread(target=self._read, name="zeroconf-shards", daemon=True)
+        self._reader.start()
+
+    @property
+    def interfaces(self) -> list[str]:
+        return list(self._workers)
+
+    @property
+    def types(self) -> list[str]:
+        return list(self._types)
+
+    def browse(self, types: list[str]) -> list[BadTypeInNameException]:
+        """Browse exactly the given types on every interface, returns the errors of bad types"""
+        errors: list[BadTypeInNameException] = []
+        valid: list[str] = []
+        for type_ in types:
+            try:
+                service_type_name(type_, strict=False)
+                valid.append(type_)
+            except BadTypeInNameException as ex:
+                errors.append(ex)
+        self._types = valid
+        self._send(('browse', valid))
+        return errors
+
+    def discover_types(self, hook: callable = None) -> None:
+        self._type_listener.set_hook(hook)
+        self._send(('discover_types', None))
+
+    def found_types(self) -> list[str]:
+        return self._type_listener.types()
+
+    def refresh(self) -> None:
+        self._send(('refresh', None))
+
+    def packets_per_minute(self) -> int:
+        """mDNS packets the workers sent in the last minute, as last reported"""
+        return sum(self._packets.values())
+
+    def close(self) -> None:
+        self._send(None)
+        for process, _ in self._workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers.clear()
+        self._events.put(None)
+        self._reader.join(timeout=5)
+
+    def _send(self, command: tuple | None) -> None:
+        for _, commands in self._workers.values():
+            commands.put(command)
+
+    def _read(self) -> None:
+        while (message := self._events.get()) is not None:
+            interface, kind, name, type_, fields = message
+            if kind == _TYPE_FOUND:
+                self._type_listener.add_service(None, SERVICE_TYPES, name)
+                continue
+            if kind == _PACKETS_SENT:
+                self._packets[interface] = name
+                continue
+            self.metrics.count('worker.events', interface)
+            seen = self._seen.get(name)
+            event = ZeroconfListener.Event.UPDATE_SERVICE
+            if kind == ZeroconfListener.Event.REMOVE_SERVICE.value:
+                if seen is None or seen.pop(interface, None) is None:
+                    continue
+                if not seen:
+                    del self._seen[name]
+                    self.lifecycle.set(name, type_, ServiceState.REMOVED)
+                    self._hook(ZeroconfListener.Event.REMOVE_SERVICE, name, type_)
+                    continue
+                # Still seen elsewhere, only the interface list changes
+                record = next(iter(seen.values()))
+            else:
+                if seen is None:
+                    seen = self._seen[name] = {}
+                    event = ZeroconfListener.Event.ADD_SERVICE
+                record = seen[interface] = ServiceRecord(name, type_, *fields)
+                self.lifecycle.set(name, type_, ServiceState.LIVE)
+            self._hook(event, name, type_, ServiceRecord(name, type_, record.server, record.port, record.ipv4, record.ipv6,
+                                                         record.properties, ', '.join(sorted(seen))))
@@ -1,15 +1,45 @@
-from enum import Enum
-from ipaddress import IPv4Address, IPv6Address
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QCloseEvent, QResizeEvent
-from PyQt6.QtWidgets import QWidget
-from zeroconf import BadTypeInNameException, ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf
-from PyQt6.QtCore import *
-from PyQt6.QtGui import *
-from PyQt6.QtWidgets import *
+from zeroconf_core import StartupProfile
 import sys
+# Before the other imports so --profile-startup can time them
+startup = StartupProfile('--profile-startup' in sys.argv)
+from PyQt6.QtCore import (QAbstractItemModel, QElapsedTimer, QModelIndex, QObject, QPoint, QSettings,
+                          QSize, QStandardPaths, QTimer, Qt, pyqtSignal, pyqtSlot)
+from PyQt6.QtGui import QAction, QBrush, QCloseEvent, QPaintEvent
+from PyQt6.QtWidgets import (QAbstractItemView, QAbstractScrollArea, QApplication, QCheckBox, QDialog, QDialogButtonBox, QDockWidget,
+                             QFileDialog, QFrame, QGridLayout, QGroupBox, QHBoxLayout, QInputDialog, QLabel, QLineEdit, QMainWindow,
+                             QMessageBox, QTableWidget, QTableWidgetItem, QTreeView, QVBoxLayout, QWidget)
+from collections import OrderedDict
+from collections.abc import KeysView
+from typing import TYPE_CHECKING
+from zeroconf_core import (LIFECYCLE_CAPACITY, RESOLVE_CONCURRENCY, STALE_TTL, EventJournal, EventQueue, Metrics, SearchIndex,
+                           ServiceLifecycle, ServiceRecord, ServiceSnapshot, ServiceState, ZeroconfListener,
+                           replay_journal, timed)
+import argparse
+import bisect
+import multiprocessing
+import os
+import threading
+import time
 import json
 
+if TYPE_CHECKING:
+    # zeroconf_discovery and with it zeroconf are imported once the window is painted
+    from zeroconf import ServiceInfo
+    from zeroconf_api import RegistryServer
+    from zeroconf_discovery import Discovery, ShardedDiscovery
+    from zeroconf_probe import ProbeEngine
+startup.mark('imports')
+
+MAX_UPDATE_RATE = 20  # batches per second
+SNAPSHOT_INTERVAL = 300  # s between snapshot saves
+SETTINGS_SAVE_DELAY = 1000  # ms to coalesce expand state writes
+LARGE_TREE_ROWS = 5000  # services above which the tree renders in large mode
+COLUMN_SAMPLE = 500  # server rows measured for the column widths in large mode
+COLUMN_PADDING = 16  # px around the text of a column
+FIRST_PAINT_TIMEOUT = 1000  # ms network setup waits for the window to paint at most
+PROBE_RESIZE_INTERVAL = 1000  # ms between fitting the Probe column to new results
+EXPANDED_CAPACITY = 2000  # expanded servers and services remembered each, least recently expanded go first
+
 stylesheet = """
 QMainWindow,
 QWidget,
@@ -59,30 +89,17 @@ QTreeView::branch:open:has-children:has-siblings {
 """
 
 
-class Worker(QRunnable):
-
-    def __init__(self, fn, *args, **kwargs) -> None:
-        super().__init__()
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-        self.setAutoDelete(True)
-
-    @pyqtSlot()
-    def run(self):
-        self.fn(*self.args, **self.kwargs)
-
 class ListServices(QDialog):
-    UPDATE = pyqtSignal(tuple)
-    
-    def __init__(self, parent, thread_pool: QThreadPool, types: list[str], types_filtered: list[str] = []) -> None:
+
+    def __init__(self, parent, types: list[str], types_filtered: list[str] = [], types_found: list[str] = [], type_found: pyqtSignal = None) -> None:
         super().__init__(parent)
 
-        self.setWindowTitle("Search for types")
+        self.setWindowTitle("Select types")
         self.resize(QSize(200, 400))
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.types_boxes = []
+        self._type_names: set[str] = set()
         groups_box_label = QLabel("Types: ", self)
         self.layout.addWidget(groups_box_label)
 
@@ -100,20 +117,13 @@ class ListServices(QDialog):
         self.grid_layout = QGridLayout()
         self.box_layout.addLayout(self.grid_layout)
         self.layout.addWidget(self.group_box)
-        col = 0
-        row = 0
+        self._col = 0
+        self._row = 0
         for type in sorted(types):
-            gCB = QCheckBox(type)
-            gCB.setTristate(True)
-            self.types_boxes.append(gCB)
-            self.grid_layout.addWidget(gCB, row, col)
+            gCB = self._add_box(type)
             gCB.setCheckState(Qt.CheckState.PartiallyChecked)
             if type in types_filtered:
                 gCB.setChecked(True)
-            row += 1
-            if row > 20:
-                row = 0
-                col += 1
 
 
         QBtn = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
@@ -122,12 +132,26 @@ class ListServices(QDialog):
         self.buttonBox.rejected.connect(self.reject)
         self.layout.addWidget(self.buttonBox)
 
-        self.UPDATE.connect(self.update)
-        self.thread_pool = thread_pool
-        self.worker = Worker(self.show_types)
-        self.thread_pool.start(self.worker)
+        for type in sorted(types_found):
+            self.add_type(type)
+        if type_found is not None:
+            # Types discovered while the dialog is open
+            type_found.connect(self.add_type)
+            self.finished.connect(lambda: type_found.disconnect(self.add_type))
         self.resize(self.box_layout.sizeHint())
 
+    def _add_box(self, type: str) -> QCheckBox:
+        gCB = QCheckBox(type)
+        gCB.setTristate(True)
+        self.types_boxes.append(gCB)
+        self._type_names.add(type)
+        self.grid_layout.addWidget(gCB, self._row, self._col)
+        self._row += 1
+        if self._row > 20:
+            self._row = 0
+            self._col += 1
+        return gCB
+
     @pyqtSlot()
     def check_all(self) -> None:
         gCB: QCheckBox
@@ -135,86 +159,632 @@ class ListServices(QDialog):
             if gCB.checkState() is not Qt.CheckState.Checked or self.all_checkbox.checkState() is Qt.CheckState.Unchecked:
                 gCB.setCheckState(self.all_checkbox.checkState())
 
-    @pyqtSlot(tuple)
-    def update(self, types: tuple) -> None:
-        self.setWindowTitle("Select types")
-        types_as_text = [ t.text() for t in self.types_boxes ]
-        new_types_found = [t for t in types if t not in types_as_text]
-        new_type: str
-        for new_type in new_types_found:
-            gCB = QCheckBox(new_type)
-            gCB.setTristate(True)
-            gCB.setChecked(self.all_checkbox.isChecked())
-            self.types_boxes.append(gCB)
-            self.box_layout.addWidget(gCB)
+    @pyqtSlot(str)
+    def add_type(self, type: str) -> None:
+        if type in self._type_names:
+            return
+        gCB = self._add_box(type)
+        gCB.setChecked(self.all_checkbox.isChecked())
         self.resize(self.box_layout.sizeHint())
 
-    def show_types(self):
-        from zeroconf import ZeroconfServiceTypes
-        types = ZeroconfServiceTypes.find()
-        self.UPDATE.emit(types)
 
+class MetricsDock(QDockWidget):
+    """Table of the hot path metrics, refreshed while visible"""
+    COLUMNS = ("Metric", "Type", "Count", "Mean ms", "p50 ms", "p95 ms", "Max ms")
+
+    def __init__(self, parent, metrics: Metrics) -> None:
+        super().__init__("Metrics", parent)
+        self.setObjectName("metrics_dock")
+        self._metrics: Metrics = metrics
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.setWidget(self.table)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibility_changed)
+
+    @pyqtSlot(bool)
+    def visibility_changed(self, visible: bool) -> None:
+        if visible:
+            self.refresh()
+            self._timer.start(1000)
+        else:
+            self._timer.stop()
 
-class ZeroconfListener(ServiceListener):
-
-    class Event(Enum):
-        UPDATE_SERVICE = 0
-        REMOVE_SERVICE = 1
-        ADD_SERVICE = 2
+    @pyqtSlot()
+    def refresh(self) -> None:
+        snapshot = self._metrics.snapshot()
+        rows: list[tuple] = []
+        for metric, stats in snapshot["latency"].items():
+            for type_, entry in [("", stats)] + sorted(stats["by_type"].items()):
+                rows.append((metric, type_, entry["count"], *(f'{1000 * entry[key]:.3f}' for key in ("mean", "p50", "p95", "max"))))
+        for metric, counter in snapshot["counters"].items():
+            for type_, count in [("", counter["total"])] + sorted(counter["by_type"].items()):
+                rows.append((metric, type_, count))
+        for metric, gauge in snapshot["gauges"].items():
+            rows.append((metric, "last / max", f'{gauge["last"]:g} / {gauge["max"]:g}'))
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column in range(len(self.COLUMNS)):
+                self.table.setItem(row, column, QTableWidgetItem(str(values[column]) if column < len(values) else ""))
+        self.table.resizeColumnsToContents()
+
+
+class TreeNode:
+    """One row in ServiceTreeModel
+
+    Server rows hold their services, service rows hold a record and build
+    their address and property rows only once they are fetched.
+    """
+    __slots__ = ('parent', 'row', 'key', 'name', 'value', 'record', 'children')
+
+    def __init__(self, parent: "TreeNode | None", name: str, value: str = "", record: ServiceRecord | None = None, key=None) -> None:
+        self.parent: TreeNode | None = parent
+        self.row: int = 0
+        # Identifies detail rows between updates, a TXT key may be named IPv4
+        self.key = name if key is None else key
+        self.name: str = name
+        self.value: str = value
+        self.record: ServiceRecord | None = record
+        # None until a service row has been fetched
+        self.children: list[TreeNode] | None = None if record is not None else []
+
+    def has_children(self) -> bool:
+        if self.children is None:
+            return self.record.has_details()
+        return len(self.children) > 0
+
+
+class ServiceRegistry:
+    """Hash indexes from names to rows in the service tree
+
+    Nodes are stored rather than row numbers so lookups stay valid while the
+    tree is sorted.
+    """
+
+    def __init__(self) -> None:
+        self._servers: dict[str, TreeNode] = {}
+        self._services: dict[tuple[str, str], TreeNode] = {}
+        self._service_servers: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._service_servers)
+
+    def server(self, server: str) -> TreeNode | None:
+        return self._servers.get(server)
+
+    def service(self, server: str, name: str) -> TreeNode | None:
+        return self._services.get((server, name))
+
+    def server_of(self, name: str) -> str | None:
+        """Server a service name is listed under"""
+        return self._service_servers.get(name)
+
+    def add_server(self, server: str, node: TreeNode) -> None:
+        self._servers[server] = node
+
+    def add_service(self, server: str, name: str, node: TreeNode) -> None:
+        self._services[(server, name)] = node
+        self._service_servers[name] = server
+
+    def services(self) -> list[TreeNode]:
+        return list(self._services.values())
+
+    def server_names(self):
+        return self._servers.keys()
+
+    def remove_server(self, server: str) -> TreeNode | None:
+        return self._servers.pop(server, None)
+
+    def remove_service(self, name: str) -> tuple[str, TreeNode] | None:
+        server = self._service_servers.pop(name, None)
+        if server is None:
+            return None
+        return server, self._services.pop((server, name))
+
+    def clear(self) -> None:
+        self._servers.clear()
+        self._services.clear()
+        self._service_servers.clear()
+
+
+class ServiceTreeModel(QAbstractItemModel):
+    """Server / service / detail tree with the Name, Value, Interface, Probe, Empty columns
+
+    Address and TXT rows of a service are created from its record when the
+    view first fetches them, collapsed services only cost their record.
+    Services of types that are not visible are kept as records only.
+    Services loaded from a snapshot are shown greyed out until a live event
+    confirms them or they expire.
+    """
+    HEADERS = ("Name", "Value", "Interface", "Probe", "Empty")  # Empty is used to adjust view port
+    PROBE_COLUMN = 3
+    SORT_COLUMNS = 2  # only Name and Value sort, server rows have neither interface nor probe
+
+    def __init__(self, parent: QObject | None = None) -> None:
+        super().__init__(parent)
+        self._root = TreeNode(None, "")
+        self._registry = ServiceRegistry()
+        # Visible services only, hidden types are not searched
+        self.search_index = SearchIndex()
+        self._hidden: dict[str, ServiceRecord] = {}
+        self._visible_types: set[str] | None = None
+        # Name to monotonic expiry time of services not seen live yet
+        self._stale: dict[str, float] = {}
+        # Name to the text of its last probe result
+        self._probes: dict[str, str] = {}
+        self._sort_column: int = -1
+        self._sort_reverse: bool = False
+
+    # Qt model interface
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return len(self.HEADERS)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        children = self._node(parent).children
+        return 0 if children is None else len(children)
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        if parent.column() > 0:
+            return False
+        return self._node(parent).has_children()
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return parent.isValid() and self._node(parent).children is None
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        node = self._node(parent)
+        if node.children is not None:
+            return
+        children = self._build_nodes(node, self._detail_spec(node.record))
+        node.children = []
+        if children:
+            self.beginInsertRows(parent, 0, len(children) - 1)
+            node.children = children
+            self.endInsertRows()
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        children = self._node(parent).children
+        if children is None or not 0 <= row < len(children) or not 0 <= column < len(self.HEADERS):
+            return QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index: QModelIndex = None) -> QModelIndex:
+        if index is None:
+            return super().parent()
+        if not index.isValid():
+            return QModelIndex()
+        parent: TreeNode = index.internalPointer().parent
+        if parent is self._root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node: TreeNode = index.internalPointer()
+        if role == Qt.ItemDataRole.ForegroundRole:
+            service = self._service_node(node) if self._stale else None
+            if service is not None and service.name in self._stale:
+                return QBrush(Qt.GlobalColor.gray)
+            return None
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if index.column() == 0:
+            return node.name
+        if index.column() == 1:
+            return node.value
+        if index.column() == 2 and node.record is not None:
+            return node.record.interface
+        if index.column() == self.PROBE_COLUMN and node.record is not None:
+            return self._probes.get(node.name)
+        return None
 
-    def __init__(self, hook: callable) -> None:
-        self._hook: callable = hook
-        super().__init__()
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
 
-    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        info: ServiceInfo = zc.get_service_info(type_, name)
-        self._hook(self.Event.UPDATE_SERVICE, name, type_, info)
-        # print(f"Service {name} updated: {type_}")
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
 
-    def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        self._hook(self.Event.REMOVE_SERVICE, name, type_)
-        # print(f"Service {name} removed {type_}")
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder) -> None:
+        if column >= self.SORT_COLUMNS:
+            return
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        nodes = [(index.internalPointer(), index.column()) for index in persistent]
+        self._sort_column = column
+        self._sort_reverse = order == Qt.SortOrder.DescendingOrder
+        self._sort_nodes(self._root.children)
+        self.changePersistentIndexList(persistent, [self.createIndex(node.row, col, node) for node, col in nodes])
+        self.layoutChanged.emit()
+
+    def sort_order(self) -> tuple[int, Qt.SortOrder]:
+        """Column and order the rows are sorted by"""
+        return self._sort_column, Qt.SortOrder.DescendingOrder if self._sort_reverse else Qt.SortOrder.AscendingOrder
+
+    # Service access
+
+    def server_index(self, server: str) -> QModelIndex:
+        node = self._registry.server(server)
+        return QModelIndex() if node is None else self.createIndex(node.row, 0, node)
+
+    def service_index(self, name: str) -> QModelIndex:
+        server = self._registry.server_of(name)
+        if server is None:
+            return QModelIndex()
+        node = self._registry.service(server, name)
+        return self.createIndex(node.row, 0, node)
+
+    def server_of(self, name: str) -> str | None:
+        return self._registry.server_of(name)
+
+    def service_names(self, server: str) -> list[str]:
+        """Names of the services on server"""
+        return [node.name for node in self._registry.server(server).children]
+
+    def server_names(self):
+        return self._registry.server_names()
+
+    def record(self, name: str) -> ServiceRecord | None:
+        server = self._registry.server_of(name)
+        if server is None:
+            return self._hidden.get(name)
+        return self._registry.service(server, name).record
+
+    def service_count(self) -> int:
+        return len(self._registry)
+
+    def records(self) -> list[ServiceRecord]:
+        """All known services, hidden ones included"""
+        return [node.record for node in self._registry.services()] + list(self._hidden.values())
+
+    def load_stale(self, records: list[ServiceRecord], ttl: float) -> None:
+        """Show records from a snapshot until confirmed or ttl seconds passed"""
+        expires = time.monotonic() + ttl
+        for record in records:
+            if self.record(record.name) is None:
+                self.upsert(record)
+                self._stale[record.name] = expires
+
+    def expire_stale(self) -> bool:
+        """Remove stale services past their expiry, returns True if any were removed"""
+        now = time.monotonic()
+        expired = [name for name, expires in self._stale.items() if expires <= now]
+        for name in expired:
+            self.remove(name)
+        return len(expired) > 0
+
+    def has_stale(self) -> bool:
+        return len(self._stale) > 0
+
+    def set_visible_types(self, types: list[str] | None, ttl: float) -> list[ServiceRecord]:
+        """Show only services of types, None shows all
+
+        Hidden services keep their stale expiry and are shown greyed out
+        again if no live event confirmed them meanwhile. Nothing reports the
+        removal of a hidden service, so those that were live come back stale
+        for ttl seconds too, until browsing their type confirms them. Returns
+        those records.
+        """
+        self._visible_types = None if types is None else set(types)
+        for node in self._registry.services():
+            if not self._is_visible(node.record.type_):
+                self._detach(node.name)
+                self._hidden[node.name] = node.record
+        expires = time.monotonic() + ttl
+        unconfirmed: list[ServiceRecord] = []
+        for record in list(self._hidden.values()):
+            if self._is_visible(record.type_):
+                if record.name not in self._stale:
+                    self._stale[record.name] = expires
+                    unconfirmed.append(record)
+                self._place(record)
+        return unconfirmed
+
+    def upsert(self, record: ServiceRecord) -> bool:
+        """Add a service or update a known one, returns False if nothing visible changed"""
+        was_stale = self._stale.pop(record.name, None) is not None
+        return self._place(record, was_stale)
+
+    def _place(self, record: ServiceRecord, was_stale: bool = False) -> bool:
+        """Put record in the tree or among the hidden ones by its type"""
+        if not self._is_visible(record.type_):
+            removed = self._detach(record.name)
+            self._hidden[record.name] = record
+            return removed
+        self._hidden.pop(record.name, None)
+        server = self._registry.server_of(record.name)
+        if server is not None and server != record.server:
+            # Service moved to another host
+            self._detach(record.name)
+
+        server_node = self._registry.server(record.server)
+        if server_node is None:
+            server_node = TreeNode(self._root, record.server)
+            self._insert(self._root, server_node)
+            self._registry.add_server(record.server, server_node)
+
+        node = self._registry.service(record.server, record.name)
+        if node is None:
+            node = TreeNode(server_node, record.name, record.address, record)
+            self._insert(server_node, node)
+            self._registry.add_service(record.server, record.name, node)
+            self.search_index.add(record)
+            return True
+
+        if node.record == record:
+            if was_stale:
+                self._repaint(node)
+            return was_stale
+        node.record = record
+        self.search_index.add(record)
+        if was_stale:
+            self._repaint(node)
+        self._set_value(node, record.address)
+        if node.children is not None:
+            self._sync_nodes(node, self._detail_spec(record))
+        return True
+
+    def remove(self, name: str) -> bool:
+        self._stale.pop(name, None)
+        self._hidden.pop(name, None)
+        self._probes.pop(name, None)
+        return self._detach(name)
+
+    def _detach(self, name: str) -> bool:
+        """Take a service out of the tree, its hidden and stale state stays"""
+        found = self._registry.remove_service(name)
+        if found is None:
+            return False
+        server, node = found
+        self.search_index.remove(name)
+        server_node = node.parent
+        self._take(server_node, node)
+        if not server_node.children:
+            self._registry.remove_server(server)
+            self._take(self._root, server_node)
+        return True
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self._root.children = []
+        self._registry.clear()
+        self._hidden.clear()
+        self._stale.clear()
+        self._probes.clear()
+        self.search_index.clear()
+        self.endResetModel()
+
+    def set_probe(self, name: str, result: str) -> None:
+        """Show the probe result of a known service"""
+        server = self._registry.server_of(name)
+        if server is None:
+            return
+        self._probes[name] = result
+        node = self._registry.service(server, name)
+        index = self.createIndex(node.row, self.PROBE_COLUMN, node)
+        self.dataChanged.emit(index, index)
+
+    # Helpers
+
+    def _is_visible(self, type_: str) -> bool:
+        return self._visible_types is None or type_ in self._visible_types
+
+    @staticmethod
+    def _service_node(node: TreeNode) -> TreeNode | None:
+        while node is not None and node.record is None:
+            node = node.parent
+        return node
+
+    def _repaint(self, node: TreeNode) -> None:
+        """Signal a service row and its fetched rows changed"""
+        self.dataChanged.emit(self.createIndex(node.row, 0, node), self.createIndex(node.row, 1, node))
+        if node.children:
+            index = self.createIndex(node.row, 0, node)
+            self.dataChanged.emit(self.index(0, 0, index), self.index(len(node.children) - 1, 1, index))
+
+    def _node(self, index: QModelIndex) -> TreeNode:
+        return index.internalPointer() if index.isValid() else self._root
+
+    def _parent_index(self, node: TreeNode) -> QModelIndex:
+        return QModelIndex() if node is self._root else self.createIndex(node.row, 0, node)
+
+    def _insert(self, parent: TreeNode, node: TreeNode) -> None:
+        """Insert node at its sorted row so the tree never needs a full re-sort"""
+        children = parent.children
+        row = self._sorted_row(children, node)
+        self.beginInsertRows(self._parent_index(parent), row, row)
+        children.insert(row, node)
+        for row in range(row, len(children)):
+            children[row].row = row
+        self.endInsertRows()
+
+    def _sort_key(self, node: TreeNode) -> str:
+        return node.name if self._sort_column == 0 else node.value
+
+    def _sorted_row(self, children: list[TreeNode], node: TreeNode) -> int:
+        """Row for node in the sorted children, which must not hold node"""
+        if self._sort_column < 0:
+            return len(children)
+        key = self._sort_key(node)
+        if not self._sort_reverse:
+            return bisect.bisect_right(children, key, key=self._sort_key)
+        low, high = 0, len(children)
+        while low < high:
+            middle = (low + high) // 2
+            if self._sort_key(children[middle]) < key:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _move_sorted(self, node: TreeNode) -> None:
+        """Move node whose sort key changed to its sorted row"""
+        children = node.parent.children
+        row = node.row
+        del children[row]
+        new_row = self._sorted_row(children, node)
+        children.insert(row, node)
+        if new_row == row:
+            return
+        parent_index = self._parent_index(node.parent)
+        # The destination counts the rows before the move
+        self.beginMoveRows(parent_index, row, row, parent_index, new_row if new_row < row else new_row + 1)
+        del children[row]
+        children.insert(new_row, node)
+        for row in range(min(row, new_row), max(row, new_row) + 1):
+            children[row].row = row
+        self.endMoveRows()
+
+    def _take(self, parent: TreeNode, node: TreeNode) -> None:
+        row = node.row
+        self.beginRemoveRows(self._parent_index(parent), row, row)
+        del parent.children[row]
+        for sibling in parent.children[row:]:
+            sibling.row -= 1
+        self.endRemoveRows()
+
+    def _set_value(self, node: TreeNode, value: str) -> None:
+        if node.value != value:
+            node.value = value
+            index = self.createIndex(node.row, 1, node)
+            self.dataChanged.emit(index, index)
+            if self._sort_column == 1:
+                self._move_sorted(node)
+
+    @staticmethod
+    def _detail_spec(record: ServiceRecord) -> list[tuple]:
+        """(key, name, value, children) of the rows below a service"""
+        spec: list[tuple] = []
+        for label, addresses in (("IPv4", record.ipv4), ("IPv6", record.ipv6)):
+            if len(addresses) == 1:
+                spec.append(((0, label), label, addresses[0], ()))
+            elif len(addresses) > 1:
+                spec.append(((0, label), label, "", [(addr, addr, "", ()) for addr in addresses]))
+        for key, value in record.properties:
+            spec.append(((1, key), key, value, ()))
+        return spec
+
+    def _build_nodes(self, parent: TreeNode, spec: list[tuple]) -> list[TreeNode]:
+        children: list[TreeNode] = []
+        for key, name, value, sub_spec in spec:
+            child = TreeNode(parent, name, value, key=key)
+            child.children = self._build_nodes(child, sub_spec)
+            children.append(child)
+        for row, child in enumerate(children):
+            child.row = row
+        # Rows fetched after a sort are kept in the same order
+        self._sort_nodes(children)
+        return children
+
+    def _sync_nodes(self, parent: TreeNode, spec: list[tuple]) -> None:
+        """Insert, remove or change only the rows that differ from spec"""
+        wanted = {key for key, _, _, _ in spec}
+        for child in reversed(parent.children[:]):
+            if child.key not in wanted:
+                self._take(parent, child)
+        existing = {child.key: child for child in parent.children}
+        for key, name, value, sub_spec in spec:
+            child = existing.get(key)
+            if child is None:
+                child = TreeNode(parent, name, value, key=key)
+                self._insert(parent, child)
+            else:
+                self._set_value(child, value)
+            self._sync_nodes(child, sub_spec)
 
-    def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        info: ServiceInfo = zc.get_service_info(type_, name)
-        self._hook(self.Event.ADD_SERVICE, name, type_, info)
-        # print(f"Service {name} added")
-        # for key, value in info.properties.items():
-        #     print(f"  {key} : {value}")
+    def _sort_nodes(self, nodes: list[TreeNode] | None) -> None:
+        if not nodes or self._sort_column < 0:
+            return
+        if self._sort_column == 0:
+            nodes.sort(key=lambda node: node.name, reverse=self._sort_reverse)
+        else:
+            nodes.sort(key=lambda node: node.value, reverse=self._sort_reverse)
+        for row, node in enumerate(nodes):
+            node.row = row
+            self._sort_nodes(node.children)
 
 
 class ZeroConfGui(QMainWindow):
-    UPDATE_SERVICE = pyqtSignal(str, str, ServiceInfo)
-    REMOVE_SERVICE = pyqtSignal(str, str)
-    ADD_SERVICE = pyqtSignal(str, str, ServiceInfo)
-
-    masterlock = QSemaphore(1)
-    locks = {}
+    EVENTS_PENDING = pyqtSignal()
+    TYPE_FOUND = pyqtSignal(str)
+    REPLAY_DONE = pyqtSignal(int)
+    PROBED = pyqtSignal(str, object)
 
-    def __init__(self):
+    def __init__(self, listen: bool = True):
+        """listen=False leaves the network and the snapshot alone, e.g. to replay a journal"""
         super().__init__()
-        self._zeroconf = None
-        self._browser = None
-        self._listener = None
+        self._listen: bool = listen
+        self._discovery: "Discovery | ShardedDiscovery | None" = None
+        self._started: bool = False
+        self._journal: EventJournal | None = None
+        self._api: "RegistryServer | None" = None
+        self._probes: "ProbeEngine | None" = None
+        self._replay_stop = threading.Event()
+        self.metrics = Metrics()
 
         self.setWindowTitle("ZeroConf GUI")
         self.setStyleSheet(stylesheet)
         self.resize(500,500)
 
-        self.thread_pool = QThreadPool()
-
         self._settings = QSettings("ZeroConfGui", "ZeroConfGui")
         print(f'Settings file: {self._settings.fileName()}')
-        self._services_expanded: list = json.loads(self._settings.value('services_expanded', '[]'))
-        self._servers_expanded: list = json.loads(self._settings.value('servers_expanded', '[]'))
+        # Names in least recently expanded order, saved in that order
+        self._services_expanded: OrderedDict[str, None] = OrderedDict.fromkeys(
+            json.loads(self._settings.value('services_expanded', '[]'))[-EXPANDED_CAPACITY:])
+        self._servers_expanded: OrderedDict[str, None] = OrderedDict.fromkeys(
+            json.loads(self._settings.value('servers_expanded', '[]'))[-EXPANDED_CAPACITY:])
+        self._expand_save_timer = QTimer(self)
+        self._expand_save_timer.setSingleShot(True)
+        self._expand_save_timer.setInterval(SETTINGS_SAVE_DELAY)
+        self._expand_save_timer.timeout.connect(self.save_tree_expand)
 
         # self._types: list = json.loads(self._settings.value('types', defaultValue='["_soap._tcp.local.", "_zmp._tcp.local."]'))
         self._types: set[str] = set(json.loads(self._settings.value('types', defaultValue='[]')))
         self._types_filtered: set[str] = set(json.loads(self._settings.value('types_filtered', defaultValue='{}')))
-
-        self.UPDATE_SERVICE.connect(self.update_service)
-        self.REMOVE_SERVICE.connect(self.remove_service)
-        self.ADD_SERVICE.connect(self.add_service)
+        self._interfaces: list[str] = json.loads(self._settings.value('interfaces', defaultValue='[]'))
+        self._passive: bool = json.loads(self._settings.value('passive', defaultValue='false'))
+        # Off by default, probing connects to every host found
+        self._probe: bool = json.loads(self._settings.value('probe', defaultValue='false'))
+        # Running while results wait for the column to be fitted to them
+        self._probe_resize_timer = QTimer(self)
+        self._probe_resize_timer.setSingleShot(True)
+        self._probe_resize_timer.setInterval(PROBE_RESIZE_INTERVAL)
+        self._probe_resize_timer.timeout.connect(self.fit_probe_column)
+        self._large_tree_rows: int = int(self._settings.value('large_tree_rows', defaultValue=LARGE_TREE_ROWS))
+        self._large_tree: bool = False
+        self._stale_timer: QTimer | None = None
+        self._column_widths: list[int] = []
+        self._resolve_concurrency: int = int(self._settings.value('resolve_concurrency', defaultValue=RESOLVE_CONCURRENCY))
+        # Stale rows of the view and stale lifecycle entries expire together
+        self._stale_ttl: int = int(self._settings.value('stale_ttl', defaultValue=STALE_TTL))
+        self.lifecycle: ServiceLifecycle = ServiceLifecycle(int(self._settings.value('lifecycle_capacity', defaultValue=LIFECYCLE_CAPACITY)),
+                                                            stale_ttl=self._stale_ttl)
+        max_update_rate: int = max(1, int(self._settings.value('max_update_rate', defaultValue=MAX_UPDATE_RATE)))
+        snapshot_file: str = self._settings.value('snapshot_file', defaultValue=os.path.join(
+            QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation), "ZeroConfGui", "services.sqlite"))
+        self._snapshot = ServiceSnapshot(snapshot_file)
+        # Empty serves no API
+        self._api_socket: str = self._settings.value('api_socket', defaultValue=os.path.join(
+            QStandardPaths.writableLocation(QStandardPaths.StandardLocation.RuntimeLocation), "zeroconf_gui.sock"))
+
+        self._events = EventQueue()
+        self._flush_interval: int = 1000 // max_update_rate
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush_events)
+        self._last_flush = QElapsedTimer()
+        self._last_flush.start()
+        self.EVENTS_PENDING.connect(self.schedule_flush)
 
         # Move window to center of screen and slightly up
         qr = self.frameGeometry()
@@ -224,6 +794,13 @@ class ZeroConfGui(QMainWindow):
         self.move(qr.topLeft())
 
         self.status_bar = self.statusBar()
+        self._lifecycle_label = QLabel()
+        self.status_bar.addPermanentWidget(self._lifecycle_label)
+        self._packets_label = QLabel()
+        self.status_bar.addPermanentWidget(self._packets_label)
+        self._status_timer = QTimer(self)
+        self._status_timer.timeout.connect(self.update_status)
+        self._status_timer.start(1000)
         self.setup_menu()
         cWidget = QWidget()
         centralLayout = QHBoxLayout()
@@ -231,28 +808,125 @@ class ZeroConfGui(QMainWindow):
         
         centralLayout.addWidget(self.create_service_table())
         self.setCentralWidget(cWidget)
+        self.metrics_dock = MetricsDock(self, self.metrics)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.metrics_dock)
+        self.metrics_dock.hide()
+        self._view_menu.addAction(self.metrics_dock.toggleViewAction())
+
+        self.REPLAY_DONE.connect(self.replay_done)
+        self.PROBED.connect(self.probed)
+        if self._listen:
+            # Shown stale in the first paint already, it only reads a local file
+            self.load_snapshot()
+            startup.mark('snapshot')
+            self._snapshot_timer = QTimer(self)
+            self._snapshot_timer.timeout.connect(self.save_snapshot)
+            self._snapshot_timer.start(1000 * int(self._settings.value('snapshot_interval', defaultValue=SNAPSHOT_INTERVAL)))
+        # The network waits for the first paint, in case it never comes for a while
+        QTimer.singleShot(FIRST_PAINT_TIMEOUT, self.start)
+        startup.mark('window')
+
+    def paintEvent(self, a0: QPaintEvent | None) -> None:
+        super().paintEvent(a0)
+        if not self._started:
+            # Run once this paint is on screen
+            QTimer.singleShot(0, self.start)
+
+    @pyqtSlot()
+    def start(self) -> None:
+        """Start browsing, probing and the API, once"""
+        if self._started:
+            return
+        self._started = True
+        startup.mark('first paint')
+        if self._listen:
+            if self._discovery is None:
+                self.start_listening(list(self._types_filtered))
+            startup.mark('network')
+        # A replay must not connect to the hosts in the journal
+        if self._listen and self._probe:
+            self.start_probing()
+        # A replay is not what is on the network, other tools must not see it
+        if self._listen and self._api_socket:
+            from zeroconf_api import RegistryServer
+            api = RegistryServer(self._api_socket, self.metrics)
+            if api.start():
+                self._api = api
+            startup.mark('API')
+        startup.report()
 
-        self.start_listening(list(self._types_filtered))
-        
     def start_listening(self, types: list[str]) -> None:
-        """Restart listening for services"""
-        if self._zeroconf:
-            self._zeroconf.close()
-        if self._browser:
-            del self._browser
-        if self._listener:
-            del self._listener
-        self.service_tree_model.removeRows(0, self.service_tree_model.rowCount())
-        self._zeroconf = Zeroconf()
-        self._listener = ZeroconfListener(self.hook)
-        try : 
-            self._browser = ServiceBrowser(self._zeroconf, types, self._listener)
-        except BadTypeInNameException as ex:
+        """Browse exactly the given types
+
+        The Zeroconf instance and its cache live as long as the window, only
+        browsers of added or dropped types are started or cancelled. Known
+        services of dropped types are hidden, not forgotten.
+        """
+        if self._discovery is None:
+            from zeroconf_discovery import Discovery, ShardedDiscovery
+            if self._interfaces:
+                self._discovery = ShardedDiscovery(self.hook, self._interfaces, self._resolve_concurrency, self.metrics, self.lifecycle,
+                                                   passive=self._passive)
+            else:
+                self._discovery = Discovery(self.hook, self._resolve_concurrency, self.metrics, self.lifecycle, passive=self._passive)
+            self._discovery.discover_types(self.TYPE_FOUND.emit)
+        for ex in self._discovery.browse(types):
             QMessageBox.warning(self, "ERROR", f"BadTypeInNameException:\n{ex}")
+        for record in self.service_tree_model.set_visible_types(types, self._stale_ttl):
+            self.lifecycle.set(record.name, record.type_, ServiceState.STALE)
+        self.watch_stale()
+        self.items_changed()
+
+    def stop_listening(self) -> None:
+        if self._discovery:
+            self._discovery.close()
+            self._discovery = None
+
+    def load_snapshot(self) -> None:
+        """Show the services known at the last run until live events arrive"""
+        self.show_stale(self._snapshot.load())
+
+    def show_stale(self, records: list[ServiceRecord]) -> None:
+        """Show records greyed out until live events confirm them or they expire"""
+        for record in records:
+            self.lifecycle.set(record.name, record.type_, ServiceState.STALE)
+        self.service_tree_model.load_stale(records, self._stale_ttl)
+        self.watch_stale()
+        self.items_changed()
+
+    def watch_stale(self) -> None:
+        """Expire stale services periodically while there are any"""
+        if self.service_tree_model.has_stale():
+            if self._stale_timer is None:
+                self._stale_timer = QTimer(self)
+                self._stale_timer.timeout.connect(self.expire_stale)
+            if not self._stale_timer.isActive():
+                self._stale_timer.start(5000)
+
+    @pyqtSlot()
+    def save_snapshot(self) -> None:
+        self._snapshot.save(self.service_tree_model.records())
+
+    @pyqtSlot()
+    def expire_stale(self) -> None:
+        if self.service_tree_model.expire_stale():
+            self.items_changed()
+        if not self.service_tree_model.has_stale():
+            self._stale_timer.stop()
 
     def closeEvent(self, a0: QCloseEvent | None) -> None:
-        if self._zeroconf:
-            self._zeroconf.close()
+        self._replay_stop.set()
+        self.stop_listening()
+        if self._api is not None:
+            self._api.close()
+            self._api = None
+        self.stop_probing()
+        self.stop_recording()
+        if self._listen and self._started:
+            self.save_snapshot()
+        if self._expand_save_timer.isActive():
+            self._expand_save_timer.stop()
+            self.save_tree_expand()
         print("Application closing")
         return super().closeEvent(a0)
 
@@ -273,6 +947,18 @@ class ZeroConfGui(QMainWindow):
         refreshAction.triggered.connect(self.refresh_view)
         file_menu.addAction(refreshAction)
 
+        export_metrics_action = QAction("&Export metrics", self)
+        export_metrics_action.setStatusTip('Save metrics as JSON')
+        export_metrics_action.triggered.connect(self.export_metrics)
+        file_menu.addAction(export_metrics_action)
+
+        self._record_action = QAction("Re&cord events", self)
+        self._record_action.setCheckable(True)
+        self._record_action.setStatusTip('Append the discovery events to a journal file')
+        self._record_action.triggered.connect(self.toggle_recording)
+        file_menu.addAction(self._record_action)
+
+        self._view_menu = mainMenu.addMenu('&View')
 
         settings_menu = mainMenu.addMenu('&Settings')
 
@@ -286,153 +972,173 @@ class ZeroConfGui(QMainWindow):
         filter_types_action.triggered.connect(self.filter_types)
         settings_menu.addAction(filter_types_action)
 
+        interfaces_action = QAction("&Interfaces", self)
+        interfaces_action.setStatusTip('Browse in one worker process per network interface')
+        interfaces_action.triggered.connect(self.set_interfaces)
+        settings_menu.addAction(interfaces_action)
+
+        passive_action = QAction("&Passive listening", self)
+        passive_action.setCheckable(True)
+        passive_action.setChecked(self._passive)
+        passive_action.setStatusTip('Only listen to announcements and answers to others, send no queries')
+        passive_action.triggered.connect(self.set_passive)
+        settings_menu.addAction(passive_action)
+
+        self._probe_action = QAction("&Probe services", self)
+        self._probe_action.setCheckable(True)
+        self._probe_action.setChecked(self._probe)
+        self._probe_action.setStatusTip('Connect to each service and show the connect time')
+        self._probe_action.triggered.connect(self.set_probe)
+        settings_menu.addAction(self._probe_action)
+
+        probe_all_action = QAction("Probe &all", self)
+        probe_all_action.setShortcut("Ctrl+P")
+        probe_all_action.setStatusTip('Probe every shown service again, recent results are reused')
+        probe_all_action.triggered.connect(self.probe_all)
+        self._view_menu.addAction(probe_all_action)
+
+        search_action = QAction("&Search", self)
+        search_action.setShortcut("Ctrl+F")
+        search_action.setStatusTip('Search services')
+        search_action.triggered.connect(lambda: self._search_box.setFocus())
+        self._view_menu.addAction(search_action)
+
     def refresh_view(self) -> None:
-        self.start_listening(list(self._types_filtered))
+        """Query all browsed types again, keeping what is already known"""
+        if self._discovery:
+            self._discovery.refresh()
 
-    def hook(self, event: ZeroconfListener.Event, name: str, type_: str, info: ServiceInfo = None) -> None:
-        match event:
-            case ZeroconfListener.Event.UPDATE_SERVICE:
-                self.UPDATE_SERVICE.emit(name, type_, info)
-            case ZeroconfListener.Event.REMOVE_SERVICE:
-                self.REMOVE_SERVICE.emit(name, type_)
-            case ZeroconfListener.Event.ADD_SERVICE:
-                self.ADD_SERVICE.emit(name, type_, info)
-            case _:
-                print("ERROR: bad event")
-    
-    @pyqtSlot(str, str, ServiceInfo)
-    def update_service(self, name: str, type_: str, info: ServiceInfo):
-        server_items: list[QStandardItem] = self.service_tree_model.findItems(info.server)
-        if len(server_items) == 0:
-            print(f"UPDATE: Server not found {info.server} {name}")
-            return
-        
-        server_item: QStandardItem = server_items[0]
-        item: QStandardItem = self.find_child(server_item, name)
+    @pyqtSlot()
+    def update_status(self) -> None:
+        counts = self.lifecycle.counts()
+        self._lifecycle_label.setText(f"{counts[ServiceState.LIVE]} live, {counts[ServiceState.RESOLVING]} resolving, "
+                                      f"{counts[ServiceState.STALE]} stale, {counts[ServiceState.REMOVED]} removed")
+        self.metrics.gauge('lifecycle.entries', len(self.lifecycle))
+        if self._discovery:
+            self._packets_label.setText(f"{'passive' if self._passive else 'active'}, {self._discovery.packets_per_minute()} packets/min")
 
-        if item is None:
-            print(f"UPDATE: Item not found {info.server} {name}")
+    @pyqtSlot()
+    def export_metrics(self) -> None:
+        path, _ = QFileDialog.getSaveFileName(self, "Export metrics", "zeroconf_metrics.json", "JSON (*.json)")
+        if path:
+            self.metrics.export(path)
+
+    @pyqtSlot(bool)
+    def toggle_recording(self, checked: bool) -> None:
+        if not checked:
+            self.stop_recording()
             return
-        
-        index: QModelIndex = self.service_tree_model.indexFromItem(item)
-        if item.hasChildren():
-            while item.rowCount() > 0:
-                self.service_tree_model.removeRow(0, index)
-        sibling: QStandardItem = self.service_tree_model.itemFromIndex(self.service_tree_model.sibling(item.row(), 1, index))
-        sibling.setText(f'{info.server}:{str(info.port)}')
-
-        if len(info._ipv4_addresses):
-            ip4_item = QStandardItem("IPv4")
-            if len(info._ipv4_addresses) == 1:
-                item.appendRow([ip4_item, QStandardItem(str(info._ipv4_addresses[0]))])
-            else:
-                item.appendRow([ip4_item])
-                addr4: IPv4Address
-                for addr4 in info._ipv4_addresses:
-                    ip4_item.appendRow(QStandardItem(str(addr4)))
-        if len(info._ipv6_addresses):
-            ip6_item = QStandardItem("IPv6")
-            if len(info._ipv6_addresses) == 1:
-                item.appendRow([ip6_item, QStandardItem(str(info._ipv6_addresses[0]))])
-            else:
-                item.appendRow([ip6_item])
-                addr6: IPv6Address
-                for addr6 in info._ipv6_addresses:
-                    ip6_item.appendRow(QStandardItem(str(addr6)))
-
-        for key, value in info.decoded_properties.items():
-            if key == '' or value is None:
-                continue
-            item.appendRow([QStandardItem(key), QStandardItem(value)])
-        if info.server in self._servers_expanded:
-            self.service_tree.expand(self.service_tree_model.indexFromItem(server_item))
-        if name in self._services_expanded:
-            self.service_tree.expand(self.service_tree_model.indexFromItem(item))
-        self.items_changed()
-
-
-    @pyqtSlot(str, str)
-    def remove_service(self, name: str, type_: str):
-        for server_item_row in range(self.service_tree_model.rowCount()):
-            server_item: QStandardItem = self.service_tree_model.item(server_item_row, 0)
-            item: QStandardItem = self.find_child(server_item, name)
-            if item is None:
-                continue
-
-            if item.hasChildren():
-                index: QModelIndex = self.service_tree_model.indexFromItem(item)
-                while item.rowCount() > 0:
-                    self.service_tree_model.removeRow(0, index)
-            self.service_tree_model.removeRow(item.row(), index.parent())
-            if not server_item.hasChildren():
-                self.service_tree_model.removeRow(server_item.row())
+        path, _ = QFileDialog.getSaveFileName(self, "Record events", "zeroconf_events.zcj", "Event journal (*.zcj)")
+        if path:
+            self.start_recording(path)
+        self._record_action.setChecked(self._journal is not None)
+
+    def start_recording(self, path: str) -> None:
+        """Append every event passed to hook to the journal at path"""
+        self.stop_recording()
+        try:
+            self._journal = EventJournal(path)
+        except OSError as ex:
+            QMessageBox.warning(self, "ERROR", f"Cannot record to {path}:\n{ex}")
             return
+        self._record_action.setChecked(True)
+        self.status_bar.showMessage(f"Recording events to {path}")
+
+    def stop_recording(self) -> None:
+        journal, self._journal = self._journal, None
+        if journal is not None:
+            journal.close()
+            self.status_bar.showMessage(f"Recorded events to {journal.path}")
+        self._record_action.setChecked(False)
+
+    def replay(self, path: str, speed: float = 1.0) -> None:
+        """Feed a journal through hook from a thread like the zeroconf threads do, speed 0 is as fast as possible"""
+        def run():
+            try:
+                replayed = replay_journal(path, self.hook, speed, self._replay_stop)
+            except (OSError, ValueError) as ex:
+                print(f"REPLAY: {ex}")
+                replayed = -1
+            self.REPLAY_DONE.emit(replayed)
+        self.status_bar.showMessage(f"Replaying {path}")
+        threading.Thread(target=run, name="zeroconf-replay", daemon=True).start()
+
+    @pyqtSlot(int)
+    def replay_done(self, replayed: int) -> None:
+        self.status_bar.showMessage("Replay failed" if replayed < 0 else f"Replayed {replayed} events")
+
+    @timed('gui.hook', type_arg=2)
+    def hook(self, event: ZeroconfListener.Event, name: str, type_: str, info: "ServiceInfo" = None) -> None:
+        journal = self._journal
+        if journal is not None:
+            journal.record(event, name, type_, info)
+        api = self._api
+        if api is not None:
+            api.hook(event, name, type_, info)
+        if self._events.put(event, name, type_, info):
+            self.EVENTS_PENDING.emit()
+        self.metrics.gauge('queue.depth', len(self._events))
 
-    def find_child(self, parent: QStandardItem, name: str) -> QStandardItem:
-        if parent.hasChildren():
-            for row in range(parent.rowCount()):
-                child: QStandardItem = parent.child(row, 0)
-                if child.text() == name:
-                    return child
-        return None
-    
-    @pyqtSlot(str, str, ServiceInfo)
-    def add_service(self, name: str, type_: str, info: ServiceInfo):
-        self.masterlock.acquire()
-        if name not in self.locks:
-            self.locks[name] = QSemaphore(1)
-        self.locks[name].acquire()
-        self.masterlock.release()
-
-        server_item_list: list[QStandardItem] = self.service_tree_model.findItems(info.server)
-        server_item: QStandardItem = None
-        if len(server_item_list) == 0:
-            server_item = QStandardItem(info.server)
-            self.service_tree_model.invisibleRootItem().appendRow([server_item, QStandardItem("")])
-        else:
-            server_item = server_item_list[0]
-
-        item: QStandardItem = self.find_child(server_item, name)
-        if item is not None:
-            self.locks[name].release()
-            self.update_service(name, type, info)
+    @pyqtSlot()
+    def schedule_flush(self) -> None:
+        """Flush pending events, at most max_update_rate times per second"""
+        if self._flush_timer.isActive():
             return
-        
-        item = QStandardItem(name)
-        server_item.appendRow([item,QStandardItem(f'{info.server}:{str(info.port)}')])
+        self._flush_timer.start(max(0, self._flush_interval - self._last_flush.elapsed()))
 
-        if len(info._ipv4_addresses):
-            ip4_item = QStandardItem("IPv4")
-            if len(info._ipv4_addresses) == 1:
-                item.appendRow([ip4_item, QStandardItem(str(info._ipv4_addresses[0]))])
-            else:
-                item.appendRow([ip4_item])
-                addr4: IPv4Address
-                for addr4 in info._ipv4_addresses:
-                    ip4_item.appendRow(QStandardItem(str(addr4)))
-        if len(info._ipv6_addresses):
-            ip6_item = QStandardItem("IPv6")
-            if len(info._ipv6_addresses) == 1:
-                item.appendRow([ip6_item, QStandardItem(str(info._ipv6_addresses[0]))])
-            else:
-                item.appendRow([ip6_item])
-                addr6: IPv6Address
-                for addr6 in info._ipv6_addresses:
-                    ip6_item.appendRow(QStandardItem(str(addr6)))
-
-        key: bytes
-        value: bytes
-        for key, value in info.decoded_properties.items():
-            if key == '' or value is None:
-                continue
-            item.appendRow([QStandardItem(key), QStandardItem(value)])
-        if info.server in self._servers_expanded:
-            self.service_tree.expand(self.service_tree_model.indexFromItem(server_item))
+    @pyqtSlot()
+    @timed('gui.flush_events')
+    def flush_events(self) -> None:
+        self._last_flush.restart()
+        changed = False
+        events = self._events.take()
+        self.metrics.gauge('queue.depth', len(self._events))
+        for event, name, type_, info in events:
+            match event:
+                case ZeroconfListener.Event.UPDATE_SERVICE:
+                    changed |= self.update_service(name, type_, info)
+                case ZeroconfListener.Event.REMOVE_SERVICE:
+                    changed |= self.remove_service(name, type_)
+                case ZeroconfListener.Event.ADD_SERVICE:
+                    changed |= self.add_service(name, type_, info)
+                case _:
+                    print("ERROR: bad event")
+        if changed:
+            self.items_changed()
+
+    @timed('gui.update_service', type_arg=1)
+    def update_service(self, name: str, type_: str, info: "ServiceInfo") -> bool:
+        if self.service_tree_model.record(name) is None:
+            # Updates of a service removed or expired meanwhile are common, only counted
+            self.metrics.count('update.unknown', type_)
+            return False
+        record = ServiceRecord.of(name, type_, info)
+        if not self.service_tree_model.upsert(record):
+            return False
+        self.restore_expanded(name, info.server)
+        if self._probes is not None:
+            self._probes.probe(record)
+        return True
+
+    @timed('gui.remove_service', type_arg=1)
+    def remove_service(self, name: str, type_: str) -> bool:
+        return self.service_tree_model.remove(name)
+
+    @timed('gui.add_service', type_arg=1)
+    def add_service(self, name: str, type_: str, info: "ServiceInfo") -> bool:
+        record = ServiceRecord.of(name, type_, info)
+        changed = self.service_tree_model.upsert(record)
+        if changed:
+            self.restore_expanded(name, info.server)
+            if self._probes is not None:
+                self._probes.probe(record)
+        return changed
+
+    def restore_expanded(self, name: str, server: str) -> None:
+        if server in self._servers_expanded:
+            self.service_tree.expand(self.service_tree_model.server_index(server))
         if name in self._services_expanded:
-            self.service_tree.expand(self.service_tree_model.indexFromItem(item))
-        self.items_changed()
-        self.locks[name].release()
-
+            self.service_tree.expand(self.service_tree_model.service_index(name))
 
     @pyqtSlot()
     def add_type(self) -> None:
@@ -440,14 +1146,93 @@ class ZeroConfGui(QMainWindow):
         type_str, ok = QInputDialog.getText(self, 'Add type', 'Type:')
         if ok:
             if type_str not in self._types:
-                self._types.append(type_str)
-                self._settings.setValue('types', json.dumps(self._types))
+                self._types.add(type_str)
+                self._settings.setValue('types', json.dumps(list(self._types)))
                 self.start_listening(list(self._types_filtered))
 
+    @pyqtSlot()
+    def set_interfaces(self) -> None:
+        """Set the interfaces to shard browsing over, none browses all in this process"""
+        text, ok = QInputDialog.getText(self, 'Interfaces', 'Interfaces, comma separated, empty for all:',
+                                        text=', '.join(self._interfaces))
+        if not ok:
+            return
+        interfaces = [interface.strip() for interface in text.split(',') if interface.strip()]
+        if interfaces == self._interfaces:
+            return
+        self._interfaces = interfaces
+        self._settings.setValue('interfaces', json.dumps(interfaces))
+        self.service_tree.setColumnHidden(2, not interfaces)
+        self.stop_listening()
+        if self._api is not None:
+            self._api.clear()
+        # Interface lists of the known rows are from the old shards
+        self.service_tree_model.clear()
+        self.start_listening(list(self._types_filtered))
+
+    def start_probing(self) -> None:
+        if self._probes is None:
+            from zeroconf_probe import ProbeEngine
+            self._probes = ProbeEngine(self.PROBED.emit, metrics=self.metrics)
+        self.probe_all()
+
+    def stop_probing(self) -> None:
+        if self._probes is not None:
+            self._probes.close()
+            self._probes = None
+
+    @pyqtSlot()
+    def probe_all(self) -> None:
+        if self._probes is None:
+            return
+        for record in self.service_tree_model.records():
+            self._probes.probe(record)
+
+    @pyqtSlot(str, object)
+    def probed(self, name: str, rtt: float | None) -> None:
+        self.service_tree_model.set_probe(name, "unreachable" if rtt is None else f"{1000 * rtt:.1f} ms")
+        # Fitting the column walks every shown row, once per interval is enough
+        if not self._large_tree and not self._probe_resize_timer.isActive():
+            self._probe_resize_timer.start()
+
+    @pyqtSlot()
+    def fit_probe_column(self) -> None:
+        if not self._large_tree:
+            self.service_tree.resizeColumnToContents(ServiceTreeModel.PROBE_COLUMN)
+
+    @pyqtSlot(bool)
+    def set_probe(self, checked: bool) -> None:
+        self._probe = checked
+        self._settings.setValue('probe', json.dumps(checked))
+        self.service_tree.setColumnHidden(ServiceTreeModel.PROBE_COLUMN, not checked)
+        if not checked:
+            self.stop_probing()
+        elif self._started and self._listen:
+            self.start_probing()
+
+    @pyqtSlot(bool)
+    def set_passive(self, checked: bool) -> None:
+        """Switch between querying and only listening, known services stay until confirmed or expired"""
+        if checked == self._passive:
+            return
+        self._passive = checked
+        self._settings.setValue('passive', json.dumps(checked))
+        if self._discovery is None:
+            return
+        records = self.service_tree_model.records()
+        self.stop_listening()
+        if self._api is not None:
+            self._api.clear()
+        # The new instance starts with an empty cache, it cannot report removals of what the old one knew
+        self.service_tree_model.clear()
+        self.show_stale(records)
+        self.start_listening(list(self._types_filtered))
+
     @pyqtSlot()
     def filter_types(self) -> None:
         """Filter types"""
-        lDialog = ListServices(self, self.thread_pool, list(self._types), list(self._types_filtered))
+        types_found = self._discovery.found_types() if self._discovery else []
+        lDialog = ListServices(self, list(self._types), list(self._types_filtered), types_found, self.TYPE_FOUND)
         if lDialog.exec():
             self._types_filtered = set()
             type_box: QCheckBox
@@ -461,7 +1246,7 @@ class ZeroConfGui(QMainWindow):
                         self._types.add(type_box.text())
                 if type_box.checkState() is Qt.CheckState.PartiallyChecked or type_box.checkState() is Qt.CheckState.Checked:
                         if type_box.text() not in self._types:
-                            self._types.append(type_box.text())
+                            self._types.add(type_box.text())
         else:
             # Cancel selected
             return
@@ -472,71 +1257,263 @@ class ZeroConfGui(QMainWindow):
     def create_service_table(self) -> QGroupBox:
         """Create a TreeView"""
         box = QGroupBox("Services")
-        bl = QHBoxLayout()
+        bl = QVBoxLayout()
         box.setLayout(bl)
         self.box = box
-        self.service_tree_model = QStandardItemModel(0, 3 , self)
-        self.service_tree_model.setHeaderData(0, Qt.Orientation.Horizontal, "Name")
-        self.service_tree_model.setHeaderData(1, Qt.Orientation.Horizontal, "Value")
-        self.service_tree_model.setHeaderData(2, Qt.Orientation.Horizontal, "Empty") #Used to adjust view port
-        self.service_tree_model.itemChanged.connect(self.items_changed)
+        self.service_tree_model = ServiceTreeModel(self)
+
+        self._search_box = QLineEdit()
+        self._search_box.setPlaceholderText("Search, e.g. printer ip:10.0. txt:model= host: type:")
+        self._search_box.setClearButtonEnabled(True)
+        self._search_box.textChanged.connect(self.apply_search)
+        self._hidden_services: set[str] = set()
+        self._hidden_servers: set[str] = set()
+        # Last query and its matches, current while the model did not change since
+        self._search_query: str = ''
+        self._search_matches: set[str] | None = None
+        self._search_current: bool = False
+        self.service_tree_model.rowsAboutToBeRemoved.connect(self.forget_hidden_rows)
+        self.service_tree_model.modelReset.connect(self.forget_hidden_rows)
+        bl.addWidget(self._search_box)
 
         self.service_tree = QTreeView()
         self.service_tree.setSizeAdjustPolicy(QAbstractScrollArea.SizeAdjustPolicy.AdjustToContents)
         self.service_tree.setModel(self.service_tree_model)
         self.service_tree.setAnimated(True)
+        self.service_tree.setUniformRowHeights(True)
         self.service_tree.setIndentation(20)
         self.service_tree.setSortingEnabled(True)
+        # The model keeps rows sorted as they are inserted from here on
+        self.service_tree.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+        self.service_tree.header().sortIndicatorChanged.connect(self.keep_sort_indicator)
+        self.service_tree.setColumnHidden(2, not self._interfaces)
+        self.service_tree.setColumnHidden(ServiceTreeModel.PROBE_COLUMN, not self._probe)
         self.service_tree.setWindowTitle("Srvc View")
         self.service_tree.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.service_tree.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
 
-        self.service_tree.expanded.connect(self.adjust_tree_columns)
-        self.service_tree.collapsed.connect(self.adjust_tree_columns)
+        self.service_tree.expanded.connect(self.tree_expanded)
+        self.service_tree.collapsed.connect(self.tree_collapsed)
+        self.service_tree_model.rowsInserted.connect(self.measure_rows)
+        self.service_tree_model.dataChanged.connect(self.measure_changed)
         bl.addWidget(self.service_tree)
         return box
 
+    @pyqtSlot(int, Qt.SortOrder)
+    def keep_sort_indicator(self, column: int, order: Qt.SortOrder) -> None:
+        """Move the sort indicator back from a column the model does not sort by"""
+        if column < ServiceTreeModel.SORT_COLUMNS:
+            return
+        header = self.service_tree.header()
+        # The view would sort again on the change
+        header.blockSignals(True)
+        header.setSortIndicator(*self.service_tree_model.sort_order())
+        header.blockSignals(False)
+        header.viewport().update()
+
+    @pyqtSlot()
+    @timed('gui.search')
+    def apply_search(self) -> None:
+        """Hide the service and server rows that do not match the search box
+
+        While the model is unchanged a query that refines the last one only
+        narrows its matches, and only the servers of services that changed
+        from matching to not or back are looked at.
+        """
+        model = self.service_tree_model
+        query = self._search_box.text()
+        previous = self._search_matches
+        if self._search_current and previous is not None and SearchIndex.refines(query, self._search_query):
+            matches = model.search_index.search(query, previous)
+        else:
+            matches = model.search_index.search(query)
+        if self._search_current:
+            # No query matches every service
+            shown = model.search_index.names()
+            self._update_hidden((shown if previous is None else previous) ^ (shown if matches is None else matches),
+                                shown if matches is None else matches)
+        else:
+            self._reset_hidden(matches)
+        self._search_query = query
+        self._search_matches = matches
+        self._search_current = True
+
+    def _reset_hidden(self, matches: set[str] | None) -> None:
+        model = self.service_tree_model
+        if matches is None:
+            hidden_services: set[str] = set()
+            hidden_servers: set[str] = set()
+        else:
+            shown_servers = set(map(model.server_of, matches))
+            hidden_servers = model.server_names() - shown_servers
+            # Services of hidden servers are hidden with them
+            hidden_services = {name for server in shown_servers for name in model.service_names(server)} - matches
+        for hidden, previous, find in ((hidden_services, self._hidden_services, model.service_index),
+                                       (hidden_servers, self._hidden_servers, model.server_index)):
+            for name in hidden - previous:
+                index = find(name)
+                self.service_tree.setRowHidden(index.row(), index.parent(), True)
+            for name in previous - hidden:
+                index = find(name)
+                if index.isValid():
+                    self.service_tree.setRowHidden(index.row(), index.parent(), False)
+        self._hidden_services = hidden_services
+        self._hidden_servers = hidden_servers
+
+    def _update_hidden(self, changed: set[str], matches: set[str] | KeysView[str]) -> None:
+        """Show or hide the servers of changed services and their services"""
+        model = self.service_tree_model
+        for server in set(map(model.server_of, changed)):
+            names = model.service_names(server)
+            shown = not matches.isdisjoint(names)
+            self._set_row_hidden(self._hidden_servers, model.server_index, server, not shown)
+            for name in names:
+                # Services of hidden servers are hidden with them
+                self._set_row_hidden(self._hidden_services, model.service_index, name, shown and name not in matches)
+
+    def _set_row_hidden(self, hidden: set[str], find: callable, name: str, hide: bool) -> None:
+        if (name in hidden) == hide:
+            return
+        index = find(name)
+        self.service_tree.setRowHidden(index.row(), index.parent(), hide)
+        if hide:
+            hidden.add(name)
+        else:
+            hidden.discard(name)
+
+    @pyqtSlot()
+    @pyqtSlot(QModelIndex, int, int)
+    def forget_hidden_rows(self, parent: QModelIndex | None = None, first: int = 0, last: int = -1) -> None:
+        """The view drops the hidden flag of removed rows, so stop tracking them"""
+        self._search_current = False
+        if parent is None:
+            self._hidden_services.clear()
+            self._hidden_servers.clear()
+            return
+        hidden = self._hidden_services if parent.isValid() else self._hidden_servers
+        for row in range(first, last + 1):
+            hidden.discard(self.service_tree_model.index(row, 0, parent).data())
+
+    @timed('gui.items_changed')
     def items_changed(self, index: int = 0) -> None:
-        num_expanded = 1
-        for server_row in range(self.service_tree_model.rowCount()):
-            row_index: QModelIndex = self.service_tree_model.index(server_row, 0)
-            sz_row = self.service_tree.sizeHintForRow(server_row)
-            if self.service_tree.isExpanded(row_index):
-                num_expanded += self.service_tree_model.itemFromIndex(row_index).rowCount()
-                server_item: QStandardItem = self.service_tree_model.itemFromIndex(row_index)
-                for service_row in range(server_item.rowCount()):
-                    service_index: QModelIndex = self.service_tree_model.index(service_row, 0, row_index)
-                    if self.service_tree.isExpanded(service_index):
-                        num_expanded += self.service_tree_model.itemFromIndex(service_index).rowCount()
+        self._search_current = False
+        if self._hidden_services or self._search_box.text():
+            self.apply_search()
+        self.set_large_tree(self.service_tree_model.service_count() > self._large_tree_rows)
+        self.adjust_tree_columns()
+
+    def set_large_tree(self, large: bool) -> None:
+        """Turn off what costs per row above large_tree_rows services
+
+        Animation and sizing to contents are off and column widths come from
+        a sample of rows, grown as rows are inserted or changed.
+        """
+        if large == self._large_tree:
+            return
+        self._large_tree = large
+        self.service_tree.setAnimated(not large)
+        self.service_tree.setSizeAdjustPolicy(QAbstractScrollArea.SizeAdjustPolicy.AdjustIgnored if large
+                                              else QAbstractScrollArea.SizeAdjustPolicy.AdjustToContents)
+        if not large:
+            return
+        model = self.service_tree_model
+        self._column_widths = [0] * (model.columnCount() - 1)
+        servers = model.rowCount()
+        for row in range(0, servers, max(1, servers // COLUMN_SAMPLE)):
+            self._measure(QModelIndex(), row, row)
+            server_index = model.index(row, 0)
+            self._measure(server_index, 0, model.rowCount(server_index) - 1)
+        for column, width in enumerate(self._column_widths):
+            self.service_tree.setColumnWidth(column, width)
+
+    @pyqtSlot(QModelIndex, int, int)
+    def measure_rows(self, parent: QModelIndex, first: int, last: int) -> None:
+        if self._large_tree:
+            self._measure(parent, first, last, apply=True)
+
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def measure_changed(self, top_left: QModelIndex, bottom_right: QModelIndex) -> None:
+        if self._large_tree:
+            self._measure(top_left.parent(), top_left.row(), bottom_right.row(), apply=True)
+
+    def _measure(self, parent: QModelIndex, first: int, last: int, apply: bool = False) -> None:
+        """Grow the column widths to fit rows first to last of parent"""
+        model = self.service_tree_model
+        font_metrics = self.service_tree.fontMetrics()
+        depth = 0
+        index = parent
+        while index.isValid():
+            depth += 1
+            index = index.parent()
+        indent = self.service_tree.indentation() * (depth + 1)
+        for row in range(first, last + 1):
+            for column, width in enumerate(self._column_widths):
+                text = model.index(row, column, parent).data()
+                if not text:
+                    continue
+                needed = font_metrics.horizontalAdvance(text) + COLUMN_PADDING + (indent if column == 0 else 0)
+                if needed > width:
+                    self._column_widths[column] = width = needed
+                    if apply:
+                        self.service_tree.setColumnWidth(column, needed)
+
+    @pyqtSlot(QModelIndex)
+    def tree_expanded(self, index: QModelIndex) -> None:
+        expanded = self._expanded_set(index)
+        if expanded is not None:
+            if index.data() in expanded:
+                expanded.move_to_end(index.data())
+            else:
+                expanded[index.data()] = None
+                if len(expanded) > EXPANDED_CAPACITY:
+                    expanded.popitem(last=False)
+                self._expand_save_timer.start()
+        self.adjust_tree_columns()
+
+    @pyqtSlot(QModelIndex)
+    def tree_collapsed(self, index: QModelIndex) -> None:
+        expanded = self._expanded_set(index)
+        if expanded is not None and index.data() in expanded:
+            del expanded[index.data()]
+            self._expand_save_timer.start()
+        self.adjust_tree_columns()
+
+    def _expanded_set(self, index: QModelIndex) -> OrderedDict[str, None] | None:
+        """Expand state set for a server or service index, None for detail rows"""
+        parent = index.parent()
+        if not parent.isValid():
+            return self._servers_expanded
+        if not parent.parent().isValid():
+            return self._services_expanded
+        return None
 
+    def adjust_tree_columns(self) -> None:
+        if self._large_tree:
+            return
         for c in range(0, self.service_tree_model.columnCount()):
             self.service_tree.resizeColumnToContents(c)
 
-        # self.resize(self.service_tree.sizeHint().width(), 176 + sz_row * num_expanded)
-        self.service_tree.sortByColumn(0, Qt.SortOrder.AscendingOrder)
-
     @pyqtSlot()
-    def adjust_tree_columns(self) -> None:
-        self.items_changed()
-        self.save_tree_expand()
-
     def save_tree_expand(self) -> None:
-        self._servers_expanded = []
-        self._services_expanded = []
-        root: QStandardItem = self.service_tree_model.invisibleRootItem()
-        for row in range(root.rowCount()):
-            server_item: QStandardItem = root.child(row, column=0)
-            if self.service_tree.isExpanded(self.service_tree_model.indexFromItem(server_item)):
-                self._servers_expanded.append(server_item.text())
-            for kid_row in range(server_item.rowCount()):
-                item: QStandardItem = root.child(kid_row, column=0)
-                if self.service_tree.isExpanded(self.service_tree_model.indexFromItem(item)):
-                    self._services_expanded.append(item.text())
-        self._settings.setValue('servers_expanded', json.dumps(list(set(self._servers_expanded))))
-        self._settings.setValue('services_expanded', json.dumps(list(set(self._services_expanded))))
+        self._settings.setValue('servers_expanded', json.dumps(list(self._servers_expanded)))
+        self._settings.setValue('services_expanded', json.dumps(list(self._services_expanded)))
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    main_window = ZeroConfGui()
+    # Interface workers are spawned from the frozen executable too
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="List ZeroConf services")
+    parser.add_argument('--record', metavar='FILE', help="append the discovery events to this journal")
+    parser.add_argument('--replay', metavar='FILE', help="show the events of a journal instead of the network")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed factor, 0 is as fast as possible")
+    parser.add_argument('--profile-startup', action='store_true', help="print the time spent per import and startup phase")
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    startup.mark('QApplication')
+    main_window = ZeroConfGui(listen=args.replay is None)
     main_window.show()
+    startup.mark('show')
+    if args.record:
+        main_window.start_recording(args.record)
+    if args.replay:
+        main_window.replay(args.replay, args.speed)
     sys.exit(app.exec())
@@ -1,5 +1,11 @@
 # -*- mode: python ; coding: utf-8 -*-
+import argparse
 
+# pyinstaller zeroconf_gui.spec -- --fast-start
+parser = argparse.ArgumentParser()
+parser.add_argument('--fast-start', action='store_true',
+                    help="build a directory instead of one file, nothing is unpacked or decompressed at start")
+options = parser.parse_args()
 
 a = Analysis(
     ['zeroconf_gui.py'],
@@ -18,14 +24,14 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
+    *([] if options.fast_start else [a.binaries, a.datas]),
     [],
+    exclude_binaries=options.fast_start,
     name='zeroconf_gui',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=not options.fast_start,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,
@@ -35,3 +41,14 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+if options.fast_start:
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='zeroconf_gui',
+    )
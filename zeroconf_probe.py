@@ -0,0 +1,134 @@
+"""Check that discovered services answer by connecting to them over TCP
+
+Every address of a service and its server name are connected to, the
+service's result is the shortest connect time of those, None when none
+answered. Does not use Qt.
+"""
+from zeroconf_core import Metrics, ServiceRecord
+import asyncio
+import threading
+import time
+
+PROBE_CONCURRENCY = 200  # connects in flight at most
+PROBE_TIMEOUT = 2  # s a connect may take
+PROBE_TTL = 30  # s a result is reused for the same host and port
+PROBE_HOST_RATE = 20  # connects per second to one host
+PROBE_HOST_BURST = 10  # connects to one host before its rate applies
+PROBE_PRUNE_SIZE = 4096  # cached results before expired ones are dropped
+
+
+class _HostLimit:
+    """Token bucket of one host"""
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self) -> None:
+        self.tokens: float = PROBE_HOST_BURST
+        self.updated: float = time.monotonic()
+
+    def delay(self, rate: float) -> float:
+        """Take a token, returns how long to wait for it"""
+        now = time.monotonic()
+        self.tokens = min(PROBE_HOST_BURST, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+
+class ProbeEngine:
+    """TCP connect probes on an asyncio loop in a thread
+
+    probe() is safe to call from any thread, hook(name, rtt) is called from
+    the probe thread with the connect time in seconds or None. Results of
+    a host and port are cached for ttl seconds and probes of the same
+    endpoint in flight are shared.
+    """
+
+    def __init__(self, hook: callable, concurrency: int = PROBE_CONCURRENCY, timeout: float = PROBE_TIMEOUT, ttl: float = PROBE_TTL,
+                 host_rate: float = PROBE_HOST_RATE, metrics: Metrics | None = None) -> None:
+        self.metrics: Metrics = metrics or Metrics()
+        self._hook: callable = hook
+        self._timeout: float = timeout
+        self._ttl: float = ttl
+        self._host_rate: float = host_rate
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Only touched from the probe loop
+        self._cache: dict[tuple[str, int], tuple[float, float | None]] = {}
+        self._in_flight: dict[tuple[str, int], asyncio.Task] = {}
+        self._limits: dict[str, _HostLimit] = {}
+        self._prune_at: int = PROBE_PRUNE_SIZE
+        self._tasks: set[asyncio.Task] = set()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="zeroconf-probe", daemon=True)
+        self._thread.start()
+
+    def probe(self, record: ServiceRecord) -> None:
+        """Probe the addresses and server of record, cached results are reused"""
+        endpoints = [(address, record.port) for address in record.ipv4 + record.ipv6]
+        if record.server:
+            endpoints.append((record.server.rstrip('.'), record.port))
+        self._loop.call_soon_threadsafe(self._start, record.name, endpoints)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def _start(self, name: str, endpoints: list[tuple[str, int]]) -> None:
+        if len(self._cache) > self._prune_at:
+            self._prune()
+        task = self._loop.create_task(self._probe_service(name, endpoints))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _cancel_all(self) -> None:
+        tasks = list(self._tasks) + list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _probe_service(self, name: str, endpoints: list[tuple[str, int]]) -> None:
+        results = await asyncio.gather(*(self._endpoint(endpoint) for endpoint in endpoints))
+        rtts = [rtt for rtt in results if rtt is not None]
+        self._hook(name, min(rtts) if rtts else None)
+
+    async def _endpoint(self, endpoint: tuple[str, int]) -> float | None:
+        cached = self._cache.get(endpoint)
+        if cached is not None and cached[0] > time.monotonic():
+            self.metrics.count('probe.cached')
+            return cached[1]
+        task = self._in_flight.get(endpoint)
+        if task is None:
+            task = self._in_flight[endpoint] = self._loop.create_task(self._connect(*endpoint))
+            task.add_done_callback(lambda _: self._in_flight.pop(endpoint, None))
+        # Shielded so one service giving up does not cancel the others waiting
+        return await asyncio.shield(task)
+
+    async def _connect(self, host: str, port: int) -> float | None:
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = _HostLimit()
+        delay = limit.delay(self._host_rate)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                transport, _ = await asyncio.wait_for(self._loop.create_connection(asyncio.Protocol, host, port), self._timeout)
+            except (OSError, asyncio.TimeoutError):
+                rtt = None
+                self.metrics.count('probe.unreachable')
+            else:
+                rtt = time.perf_counter() - start
+                transport.abort()
+                self.metrics.observe('probe', rtt)
+        self._cache[(host, port)] = (time.monotonic() + self._ttl, rtt)
+        return rtt
+
+    def _prune(self) -> None:
+        """Drop expired results and the limits of hosts back at full burst"""
+        now = time.monotonic()
+        self._cache = {endpoint: result for endpoint, result in self._cache.items() if result[0] > now}
+        refilled = now - PROBE_HOST_BURST / self._host_rate
+        self._limits = {host: limit for host, limit in self._limits.items() if limit.updated > refilled}
+        self._prune_at = 2 * len(self._cache) + PROBE_PRUNE_SIZE